@@ -3,9 +3,20 @@ import asyncio
 import uuid
 import os
 import time
-import re
+import json
+import itertools
+import functools
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from typing import List
 
+import aiofiles
+import diskcache
+from cachetools import TTLCache
+import numpy as np
+import semchunk
+from blake3 import blake3
+
 from fastapi import FastAPI, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 from langchain_community.document_loaders import (
@@ -13,8 +24,6 @@ from langchain_community.document_loaders import (
 )
 from langchain_pinecone import PineconeVectorStore
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
@@ -47,71 +56,88 @@ app = FastAPI(title="Async RAG API")
 # -------------------------------
 # Global reusable objects
 # -------------------------------
-EMBEDDINGS = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-LLM = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=gemini_api_key, temperature=0.1)
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+@functools.lru_cache(maxsize=1)
+def _embedding_device():
+    # torch is imported here rather than at module scope so importing this module stays light
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+@functools.lru_cache(maxsize=1)
+def _embedding_backend():
+    # ONNX Runtime avoids most of the PyTorch overhead on CPU; on GPU the FP16 torch model is faster
+    return os.getenv("EMBEDDING_BACKEND") or ("torch" if _embedding_device() == "cuda" else "onnx")
+
+def _embedding_model_kwargs():
+    import torch
+    device = _embedding_device()
+    if _embedding_backend() == "onnx":
+        provider = "CUDAExecutionProvider" if device == "cuda" else "CPUExecutionProvider"
+        return {"device": device, "backend": "onnx", "model_kwargs": {"provider": provider}}
+    # FP16 weights on GPU halve memory bandwidth and use tensor cores; CPU stays FP32
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    return {"device": device, "model_kwargs": {"torch_dtype": dtype}}
+
+# The embedding model and LLM are loaded on first use, so importing this module (in every
+# uvicorn worker and every document-parsing process) does not pay for them
+_EMBEDDINGS = None
+_LLM = None
+_MODEL_LOCK = threading.Lock()
+
+def get_embeddings():
+    global _EMBEDDINGS
+    if _EMBEDDINGS is None:
+        with _MODEL_LOCK:
+            if _EMBEDDINGS is None:
+                from langchain_huggingface import HuggingFaceEmbeddings
+                _EMBEDDINGS = HuggingFaceEmbeddings(
+                    model_name=EMBEDDING_MODEL,
+                    model_kwargs=_embedding_model_kwargs(),
+                    encode_kwargs={"batch_size": 256, "normalize_embeddings": True},
+                )
+    return _EMBEDDINGS
+
+def get_llm():
+    global _LLM
+    if _LLM is None:
+        with _MODEL_LOCK:
+            if _LLM is None:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                _LLM = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=gemini_api_key, temperature=0.1)
+    return _LLM
+
 PC = Pinecone(api_key=pinecone_api_key)
 INDEX_NAME = "hugging-face-index"
 
-# Ensure Pinecone index exists
-if INDEX_NAME not in PC.list_indexes().names():
-    logger.info("Creating new index...")
-    PC.create_index(
-        name=INDEX_NAME,
-        dimension=384,
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region="us-east-1")
-    )
-    time.sleep(10)
-else:
-    logger.info("Index already exists")
-
-# -------------------------------
-# Semantic Chunking
-# -------------------------------
-def semantic_chunk_documents(docs):
-    """Apply semantic chunking based on paragraph breaks and topic boundaries."""
-    semantic_chunks = []
-    
-    for doc in docs:
-        text = doc.page_content
-        
-        # Split by double newlines (paragraph breaks) first
-        paragraphs = text.split('\n\n')
-        
-        current_chunk = ""
-        for para in paragraphs:
-            para = para.strip()
-            if not para:
-                continue
-                
-            # If adding this paragraph would exceed 2000 chars, save current chunk
-            if len(current_chunk) + len(para) > 2000 and current_chunk:
-                # Add overlap by including last sentence from previous chunk
-                sentences = re.split(r'[.!?]+', current_chunk)
-                overlap = sentences[-1].strip() if len(sentences) > 1 else ""
-                
-                semantic_chunks.append(Document(
-                    page_content=current_chunk.strip(),
-                    metadata=doc.metadata
-                ))
-                
-                # Start new chunk with overlap
-                current_chunk = overlap + " " + para if overlap else para
-            else:
-                current_chunk += " " + para if current_chunk else para
-        
-        # Add the last chunk
-        if current_chunk.strip():
-            semantic_chunks.append(Document(
-                page_content=current_chunk.strip(),
-                metadata=doc.metadata
-            ))
-    
-    # Filter out very small chunks
-    semantic_chunks = [chunk for chunk in semantic_chunks if len(chunk.page_content) > 100]
-    
-    logger.info(f"Generated {len(semantic_chunks)} semantic chunks")
-    return semantic_chunks
+# Pinecone upsert tuning; the batch size is auto-tuned on the first upload unless set explicitly,
+# concurrency is fixed (PINECONE_CONCURRENCY) and not tuned
+PINECONE_BATCH_SIZE = int(os.getenv("PINECONE_BATCH_SIZE", 100))
+PINECONE_CONCURRENCY = int(os.getenv("PINECONE_CONCURRENCY", 4))
+PINECONE_TUNE_FILE = ".pinecone_tune.json"
+PINECONE_TUNE_BATCH_SIZES = [32, 64, 128, 256, 512]
+
+# Set by the startup handler once the index is ready
+INDEX = None
+
+@app.on_event("startup")
+async def ensure_pinecone_index():
+    """Create the Pinecone index if needed and wait for it without blocking the event loop."""
+    global INDEX
+    if INDEX_NAME not in PC.list_indexes().names():
+        logger.info("Creating new index...")
+        PC.create_index(
+            name=INDEX_NAME,
+            dimension=384,
+            metric="cosine",
+            spec=ServerlessSpec(cloud="aws", region="us-east-1")
+        )
+        while not PC.describe_index(INDEX_NAME).status["ready"]:
+            await asyncio.sleep(0.5)
+    else:
+        logger.info("Index already exists")
+
+    INDEX = PC.Index(INDEX_NAME)
 
 # -------------------------------
 # Document loading
@@ -130,62 +156,196 @@ def load_documents(file_path: str):
         raise ValueError(f"Unsupported file format: {ext}")
     return loader.load()
 
+# Worker processes for document parsing; load_documents is module-level so it pickles cleanly
+PDF_POOL = ProcessPoolExecutor(max_workers=os.cpu_count())
+
+# Chunk size in embedding-model tokens; all-MiniLM-L6-v2 truncates inputs beyond 256 tokens
+CHUNK_TOKENS = 256
+CHUNKER = semchunk.chunkerify(EMBEDDING_MODEL, chunk_size=CHUNK_TOKENS)
+
 def chunk_documents(docs):
-    # Use semantic chunking instead of character-based chunking
-    chunks = semantic_chunk_documents(docs)
+    # Sentence-aware, token-sized chunking (semchunk) instead of character windows
+    texts_chunks = CHUNKER([doc.page_content for doc in docs], processes=1)
+    chunks = [
+        Document(page_content=text, metadata=doc.metadata)
+        for doc, texts in zip(docs, texts_chunks)
+        for text in texts
+    ]
     logger.info(f"Generated {len(chunks)} chunks")
     return chunks
 
+# -------------------------------
+# Embedding cache
+# -------------------------------
+# Persistent content-hash -> embedding cache so re-uploaded or unchanged chunks are not re-embedded
+EMBEDDING_CACHE = diskcache.Cache("emb_cache")
+
+def embed_with_cache(texts):
+    """Embed texts, reusing cached vectors for content that was embedded before."""
+    # Key on the model, backend and device too, so switching any of them (different vectors,
+    # dimension or precision) never serves embeddings from the previous configuration
+    model_key = f"{EMBEDDING_MODEL}|{_embedding_backend()}|{_embedding_device()}\0".encode("utf-8")
+    hashes = [blake3(model_key + text.encode("utf-8")).hexdigest() for text in texts]
+    embeddings = [EMBEDDING_CACHE.get(h) for h in hashes]
+    misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+    if misses:
+        new_embeddings = get_embeddings().embed_documents([texts[i] for i in misses])
+        for i, embedding in zip(misses, new_embeddings):
+            EMBEDDING_CACHE[hashes[i]] = embedding
+            embeddings[i] = embedding
+
+    logger.info(f"Embedding cache: {len(texts) - len(misses)} hits, {len(misses)} misses")
+    return embeddings
+
+# -------------------------------
+# Embedding quantization
+# -------------------------------
+def quantize_int8(embeddings):
+    """Absmax-quantize each embedding to int8 levels.
+
+    Scaling a vector by a positive constant leaves its cosine similarity unchanged,
+    so the integer-valued vectors can be queried with plain float query embeddings.
+    Integer values serialize far more compactly than full-precision floats on upsert.
+    """
+    if not embeddings:
+        return [], []
+    vecs = np.asarray(embeddings, dtype=np.float32)
+    scales = np.max(np.abs(vecs), axis=1, keepdims=True) / 127
+    scales[scales == 0] = 1.0
+    quantized = np.round(vecs / scales).astype(np.int8)
+    return quantized.astype(int).tolist(), scales.ravel().tolist()
+
+# -------------------------------
+# Pinecone batch size tuning
+# -------------------------------
+def load_tuned_batch_size():
+    """Return the configured or previously tuned batch size, or None if it still needs tuning."""
+    if os.getenv("PINECONE_BATCH_SIZE"):
+        return PINECONE_BATCH_SIZE
+    try:
+        with open(PINECONE_TUNE_FILE, "r", encoding="utf-8") as f:
+            return int(json.load(f)["batch_size"])
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+
+async def autotune_batch_size(vectors, namespace):
+    """Upsert the leading vectors with each candidate batch size and persist the fastest one.
+
+    Returns the chosen batch size and how many vectors were already stored.
+    """
+    loop = asyncio.get_running_loop()
+    throughput = {}
+    offset = 0
+    for size in PINECONE_TUNE_BATCH_SIZES:
+        batch = vectors[offset:offset + size]
+        if len(batch) < size:
+            break
+        start = time.perf_counter()
+        await loop.run_in_executor(None, lambda: INDEX.upsert(vectors=batch, namespace=namespace))
+        throughput[size] = size / (time.perf_counter() - start)
+        offset += size
+
+    if not throughput:
+        return PINECONE_BATCH_SIZE, offset
+
+    best = max(throughput, key=throughput.get)
+    with open(PINECONE_TUNE_FILE, "w", encoding="utf-8") as f:
+        json.dump({"batch_size": best}, f)
+    logger.info(f"Tuned Pinecone batch size: {best} ({throughput[best]:.0f} vectors/s)")
+    return best, offset
+
+def dedupe_chunks(chunks):
+    """Drop repeated chunks (headers, footers, boilerplate) by normalized content hash.
+
+    The first occurrence is kept as the canonical chunk and records how many copies were folded into it.
+    """
+    seen = {}
+    unique_chunks = []
+    for chunk in chunks:
+        key = blake3(chunk.page_content.lower().strip().encode("utf-8")).digest()
+        if key in seen:
+            canonical = unique_chunks[seen[key]]
+            canonical.metadata["duplicates"] = canonical.metadata.get("duplicates", 0) + 1
+            continue
+        seen[key] = len(unique_chunks)
+        chunk.metadata = dict(chunk.metadata)
+        unique_chunks.append(chunk)
+    logger.info(f"Deduplicated {len(chunks)} chunks to {len(unique_chunks)}")
+    return unique_chunks
+
 # -------------------------------
 # Async document processing
 # -------------------------------
-async def process_and_store_documents(file_paths: List[str], batch_size=64):
-    all_docs = []
-    for fp in file_paths:
-        all_docs.extend(load_documents(fp))
-        logger.info(f"Loaded {len(all_docs)} pages from {fp}")
+async def process_and_store_documents(file_paths: List[str], batch_size=None):
+    # Parse files in parallel worker processes (PDF parsing is CPU-bound and GIL-bound)
+    loop = asyncio.get_running_loop()
+    docs_lists = await asyncio.gather(
+        *[loop.run_in_executor(PDF_POOL, load_documents, fp) for fp in file_paths]
+    )
+    for fp, docs in zip(file_paths, docs_lists):
+        logger.info(f"Loaded {len(docs)} pages from {fp}")
+    all_docs = list(itertools.chain.from_iterable(docs_lists))
 
-    chunks = chunk_documents(all_docs)
+    # Tokenizing every page is CPU-bound, so keep it off the event loop
+    chunks = dedupe_chunks(await loop.run_in_executor(None, chunk_documents, all_docs))
     logger.info(f"Created {len(chunks)} chunks from all documents")
 
     # Save chunks locally for debugging
-    with open("chunks.txt", "w", encoding="utf-8") as f:
-        for i, chunk in enumerate(chunks):
-            f.write(f"\n--- Chunk {i+1} ---\n")
-            f.write(chunk.page_content + "\n")
+    if os.getenv("DEBUG_DUMP_CHUNKS"):
+        with open("chunks.txt", "w", encoding="utf-8") as f:
+            for i, chunk in enumerate(chunks):
+                f.write(f"\n--- Chunk {i+1} ---\n")
+                f.write(chunk.page_content + "\n")
 
     namespace = uuid.uuid4().hex
     logger.info(f"Using namespace: {namespace}")
 
-    # Async batch upsertion
-    async def upsert_batch(batch_chunks, batch_number, total_batches):
-        PineconeVectorStore.from_documents(batch_chunks, EMBEDDINGS, namespace=namespace, index_name=INDEX_NAME)
-        logger.info(f"Stored batch {batch_number}/{total_batches}")
+    # Empty or image-only files yield no text; there is nothing to embed or upsert
+    if not chunks:
+        logger.warning("No chunks extracted; skipping embedding and upsert")
+        return namespace
+
+    # Embed uncached chunks in one call (the model batches internally), off the event loop
+    texts = [chunk.page_content for chunk in chunks]
+    embeddings = await loop.run_in_executor(None, embed_with_cache, texts)
+
+    quantized, scales = quantize_int8(embeddings)
+
+    # Same layout PineconeVectorStore uses, so from_existing_index can read it back.
+    # Chunk ids only need to be unique within the (random) namespace, so a counter suffices.
+    vectors = [
+        (f"{namespace}-{i}", values, {**chunk.metadata, "text": chunk.page_content, "int8_scale": scale})
+        for i, (chunk, values, scale) in enumerate(zip(chunks, quantized, scales))
+    ]
+
+    if batch_size is None:
+        batch_size = load_tuned_batch_size()
+    if batch_size is None:
+        batch_size, stored = await autotune_batch_size(vectors, namespace)
+        vectors = vectors[stored:]
 
-    tasks = []
-    total_batches = (len(chunks) + batch_size - 1) // batch_size
-    for i in range(0, len(chunks), batch_size):
-        batch_chunks = chunks[i:i+batch_size]
-        batch_number = i // batch_size + 1
-        tasks.append(upsert_batch(batch_chunks, batch_number, total_batches))
+    # Concurrent, bounded batch upsertion
+    semaphore = asyncio.Semaphore(PINECONE_CONCURRENCY)
+    total_batches = (len(vectors) + batch_size - 1) // batch_size
 
-    await asyncio.gather(*tasks)
+    async def upsert_batch(batch, batch_number):
+        async with semaphore:
+            await loop.run_in_executor(None, lambda: INDEX.upsert(vectors=batch, namespace=namespace))
+        logger.info(f"Stored batch {batch_number}/{total_batches}")
+
+    await asyncio.gather(*[
+        upsert_batch(vectors[i:i+batch_size], i // batch_size + 1)
+        for i in range(0, len(vectors), batch_size)
+    ])
     logger.info("✅ All embeddings stored in Pinecone")
     return namespace
 
 # -------------------------------
 # Async query retrieval
 # -------------------------------
-async def retrieve_and_answer(query: str, namespace: str):
-    vector_store = PineconeVectorStore.from_existing_index(
-        index_name=INDEX_NAME,
-        embedding=EMBEDDINGS,
-        namespace=namespace
-    )
-
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5, "namespace": namespace})
-
-    prompt_template = """You are a helpful assistant that answers questions based on the provided context. 
+QA_PROMPT = PromptTemplate(
+    template="""You are a helpful assistant that answers questions based on the provided context. 
 Use only the information from the context to answer the question. If the answer is not available in the context, 
 say "I cannot find this information in the provided documents."
 
@@ -194,22 +354,42 @@ Context:
 
 Question: {question}
 
-Answer: """
+Answer: """,
+    input_variables=["context", "question"]
+)
 
-    prompt = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=LLM,
+# Repeated questions against the same document set are answered from memory for 5 minutes
+ANSWER_CACHE = TTLCache(maxsize=1024, ttl=300)
+
+@functools.lru_cache(maxsize=256)
+def _get_retriever(namespace: str):
+    vector_store = PineconeVectorStore(index=INDEX, embedding=get_embeddings(), namespace=namespace)
+    return vector_store.as_retriever(search_kwargs={"k": 3, "namespace": namespace})
+
+@functools.lru_cache(maxsize=256)
+def _get_qa_chain(namespace: str):
+    return RetrievalQA.from_chain_type(
+        llm=get_llm(),
         chain_type="stuff",
-        retriever=retriever,
-        chain_type_kwargs={"prompt": prompt},
+        retriever=_get_retriever(namespace),
+        chain_type_kwargs={"prompt": QA_PROMPT},
         return_source_documents=True
     )
 
+async def retrieve_and_answer(query: str, namespace: str):
+    cache_key = (namespace, query)
+    if cache_key in ANSWER_CACHE:
+        return ANSWER_CACHE[cache_key]
+
+    qa_chain = _get_qa_chain(namespace)
+
     try:
-        result = qa_chain.invoke({"query": query})
+        result = await qa_chain.ainvoke({"query": query})
         sources = [{"snippet": doc.page_content[:200] + ("..." if len(doc.page_content) > 200 else "")}
                    for doc in result['source_documents']]
-        return {"answer": result['result'], "sources": sources}
+        answer = {"answer": result['result'], "sources": sources}
+        ANSWER_CACHE[cache_key] = answer
+        return answer
     except Exception as e:
         logger.error(f"❌ Error processing query: {e}")
         return {"answer": None, "sources": [], "error": str(e)}
@@ -217,6 +397,8 @@ Answer: """
 # -------------------------------
 # API Endpoints
 # -------------------------------
+UPLOAD_CHUNK_SIZE = 1 << 20  # stream uploads to disk 1 MiB at a time
+
 @app.post("/upload")
 async def upload_documents(files: List[UploadFile] = File(...)):
     saved_files = []
@@ -224,8 +406,9 @@ async def upload_documents(files: List[UploadFile] = File(...)):
         for file in files:
             save_path = os.path.join("uploads", file.filename)
             os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            with open(save_path, "wb") as f:
-                f.write(await file.read())
+            async with aiofiles.open(save_path, "wb") as f:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
             saved_files.append(save_path)
         namespace = await process_and_store_documents(saved_files)
         return {"status": "success", "namespace": namespace}
@@ -1,57 +1,190 @@
-import json
-import os
+import asyncio
+import sqlite3
+import threading
 import uuid
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from pathlib import Path
 
+import orjson
+
 class JSONDatabase:
+    """Document store for JSON records, backed by SQLite.
+
+    Each entity lives in its own table as a JSON payload keyed by id, with
+    indexed lookup columns (email, user_id). Chat messages are stored as
+    individual rows so appending a message never rewrites a whole session,
+    and message writes are buffered and flushed in batches.
+    """
+
+    # Table name -> legacy JSON file that seeds it on first run
+    TABLES = {
+        "users": "users.json",
+        "lawyers": "lawyers.json",
+        "chat_sessions": "chat_sessions.json",
+        "case_studies": "case_studies.json",
+        "bookings": "bookings.json",
+        "document_sets": "document_sets.json",
+    }
+
     def __init__(self, data_dir: str = "data"):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True)
-        
-        # Initialize database files
-        self.users_file = self.data_dir / "users.json"
-        self.lawyers_file = self.data_dir / "lawyers.json"
-        self.chat_sessions_file = self.data_dir / "chat_sessions.json"
-        self.case_studies_file = self.data_dir / "case_studies.json"
-        self.bookings_file = self.data_dir / "bookings.json"
-        self.document_sets_file = self.data_dir / "document_sets.json"
-        
-        # Create files if they don't exist
-        self._init_file(self.users_file, {})
-        self._init_file(self.lawyers_file, {})
-        self._init_file(self.chat_sessions_file, {})
-        self._init_file(self.case_studies_file, {})
-        self._init_file(self.bookings_file, {})
-        self._init_file(self.document_sets_file, {})
-        
+        self.db_file = self.data_dir / "data.db"
+
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # Serve reads from a memory-mapped view of the database file instead of read() syscalls
+        self.conn.execute("PRAGMA mmap_size=268435456")
+
+        # Write-behind buffer of (session_id, message) pairs, flushed in one transaction
+        self._pending_messages: List[tuple] = []
+
+        # Create tables and import any existing JSON data
+        self._init_schema()
+        self._migrate_json_files()
+
         # Initialize with sample lawyers
         self._init_sample_lawyers()
-    
-    def _init_file(self, file_path: Path, default_data: Any):
-        """Initialize a JSON file with default data if it doesn't exist"""
-        if not file_path.exists():
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(default_data, f, indent=2, default=str)
-    
-    def _load_data(self, file_path: Path) -> Dict:
-        """Load data from a JSON file"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
-    
-    def _save_data(self, file_path: Path, data: Dict):
-        """Save data to a JSON file"""
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, default=str, ensure_ascii=False)
-    
+
+    def _init_schema(self):
+        """Create tables and indexes if they don't exist"""
+        with self._lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id TEXT PRIMARY KEY, email TEXT, data TEXT NOT NULL
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email);
+
+                CREATE TABLE IF NOT EXISTS lawyers (
+                    id TEXT PRIMARY KEY, data TEXT NOT NULL
+                );
+
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    id TEXT PRIMARY KEY, user_id TEXT, data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_chat_sessions_user ON chat_sessions(user_id);
+
+                CREATE TABLE IF NOT EXISTS messages (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    ts TEXT NOT NULL,
+                    payload TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, seq);
+
+                CREATE TABLE IF NOT EXISTS case_studies (
+                    id TEXT PRIMARY KEY, user_id TEXT, data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_case_studies_user ON case_studies(user_id);
+
+                CREATE TABLE IF NOT EXISTS bookings (
+                    id TEXT PRIMARY KEY, user_id TEXT, data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings(user_id);
+                CREATE INDEX IF NOT EXISTS idx_bookings_slot ON bookings(
+                    json_extract(data, '$.lawyer_id'), json_extract(data, '$.appointment_time')
+                );
+
+                CREATE TABLE IF NOT EXISTS document_sets (
+                    id TEXT PRIMARY KEY, user_id TEXT, data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_document_sets_user ON document_sets(user_id);
+            """)
+
+    def _migrate_json_files(self):
+        """Import records from the legacy JSON files into empty tables"""
+        for table, file_name in self.TABLES.items():
+            file_path = self.data_dir / file_name
+            if not file_path.exists() or self._count(table):
+                continue
+            try:
+                records = orjson.loads(file_path.read_bytes())
+            except orjson.JSONDecodeError:
+                continue
+            with self._lock, self.conn:
+                for record_id, record in records.items():
+                    if table == "chat_sessions":
+                        for message in record.pop("messages", []):
+                            self._insert_message(record_id, message)
+                    self._put(table, record_id, record)
+
+    def _dumps(self, data: Any) -> str:
+        """Serialize a record payload"""
+        # orjson handles datetimes natively; default=str covers anything else (e.g. Path)
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    def _count(self, table: str) -> int:
+        """Count rows in a table"""
+        with self._lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def _count_since(self, table: str, user_id: str, since: str) -> int:
+        """Count a user's records created after an ISO timestamp"""
+        # created_at is always datetime.isoformat(), so string order matches time order
+        with self._lock:
+            return self.conn.execute(
+                f"SELECT COUNT(*) FROM {table} WHERE user_id = ? "
+                "AND json_extract(data, '$.created_at') > ?",
+                (user_id, since)
+            ).fetchone()[0]
+
+    def _get(self, table: str, record_id: str) -> Optional[Dict]:
+        """Load a single record by ID"""
+        with self._lock:
+            row = self.conn.execute(f"SELECT data FROM {table} WHERE id = ?", (record_id,)).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def _list(self, table: str, where: str = "", params: tuple = ()) -> List[Dict]:
+        """Load all records matching an optional WHERE clause"""
+        with self._lock:
+            rows = self.conn.execute(f"SELECT data FROM {table} {where}", params).fetchall()
+        return [orjson.loads(row[0]) for row in rows]
+
+    def _put(self, table: str, record_id: str, record: Dict):
+        """Insert or replace a single record, keeping lookup columns in sync"""
+        payload = self._dumps(record)
+        if table == "users":
+            self.conn.execute(
+                "INSERT OR REPLACE INTO users (id, email, data) VALUES (?, ?, ?)",
+                (record_id, record.get("email"), payload)
+            )
+        elif table == "lawyers":
+            self.conn.execute(
+                "INSERT OR REPLACE INTO lawyers (id, data) VALUES (?, ?)",
+                (record_id, payload)
+            )
+        else:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO {table} (id, user_id, data) VALUES (?, ?, ?)",
+                (record_id, record.get("user_id"), payload)
+            )
+
+    def _save(self, table: str, record_id: str, record: Dict):
+        """Persist a single record in its own transaction"""
+        with self._lock, self.conn:
+            self._put(table, record_id, record)
+
+    def _insert_message(self, session_id: str, message: Dict):
+        """Append one message row to a session"""
+        self.conn.execute(
+            "INSERT INTO messages (session_id, ts, payload) VALUES (?, ?, ?)",
+            (session_id, message.get("timestamp", ""), self._dumps(message))
+        )
+
+    def _session_messages(self, session_id: str) -> List[Dict]:
+        """Load a session's messages in insertion order"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT payload FROM messages WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+        return [orjson.loads(row[0]) for row in rows]
+
     def _init_sample_lawyers(self):
         """Initialize sample lawyers if none exist"""
-        lawyers = self._load_data(self.lawyers_file)
-        if not lawyers:
+        if not self._count("lawyers"):
             sample_lawyers = {
                 "lawyer_1": {
                     "id": "lawyer_1",
@@ -78,15 +211,16 @@ class JSONDatabase:
                     "created_at": datetime.now().isoformat()
                 }
             }
-            self._save_data(self.lawyers_file, sample_lawyers)
-    
+            with self._lock, self.conn:
+                for lawyer_id, lawyer in sample_lawyers.items():
+                    self._put("lawyers", lawyer_id, lawyer)
+
     # User operations
     def create_user(self, user_data: Dict) -> str:
         """Create a new user and return user ID"""
-        users = self._load_data(self.users_file)
         user_id = str(uuid.uuid4())
-        
-        users[user_id] = {
+
+        user = {
             **user_data,
             "id": user_id,
             "created_at": datetime.now().isoformat(),
@@ -96,169 +230,244 @@ class JSONDatabase:
             "case_study_history": [],
             "expert_advice_bookings": []
         }
-        
-        self._save_data(self.users_file, users)
+
+        self._save("users", user_id, user)
         return user_id
-    
+
     def get_user_by_email(self, email: str) -> Optional[Dict]:
         """Get user by email"""
-        users = self._load_data(self.users_file)
-        for user in users.values():
-            if user.get("email") == email:
-                return user
-        return None
-    
+        users = self._list("users", "WHERE email = ?", (email,))
+        return users[0] if users else None
+
     def get_user_by_id(self, user_id: str) -> Optional[Dict]:
         """Get user by ID"""
-        users = self._load_data(self.users_file)
-        return users.get(user_id)
-    
+        return self._get("users", user_id)
+
     def update_user(self, user_id: str, update_data: Dict) -> bool:
         """Update user data"""
-        users = self._load_data(self.users_file)
-        if user_id in users:
-            users[user_id].update(update_data)
-            self._save_data(self.users_file, users)
+        with self._lock:
+            user = self._get("users", user_id)
+            if user is None:
+                return False
+            user.update(update_data)
+            self._save("users", user_id, user)
             return True
-        return False
-    
+
     # Chat session operations
     def create_chat_session(self, user_id: str, title: str) -> str:
         """Create a new chat session"""
-        sessions = self._load_data(self.chat_sessions_file)
         session_id = str(uuid.uuid4())
-        
-        sessions[session_id] = {
+
+        session = {
             "id": session_id,
             "user_id": user_id,
             "title": title,
-            "messages": [],
             "created_at": datetime.now().isoformat(),
             "updated_at": datetime.now().isoformat()
         }
-        
-        self._save_data(self.chat_sessions_file, sessions)
+
+        self._save("chat_sessions", session_id, session)
         return session_id
-    
+
     def get_user_chat_sessions(self, user_id: str) -> List[Dict]:
         """Get all chat sessions for a user"""
-        sessions = self._load_data(self.chat_sessions_file)
-        return [session for session in sessions.values() if session.get("user_id") == user_id]
-    
+        self.flush_messages()
+        sessions = self._list("chat_sessions", "WHERE user_id = ?", (user_id,))
+        by_id = {session["id"]: session for session in sessions}
+        for session in sessions:
+            session["messages"] = []
+
+        # One indexed query for all of the user's messages instead of one per session
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT m.session_id, m.payload FROM messages m "
+                "JOIN chat_sessions s ON s.id = m.session_id "
+                "WHERE s.user_id = ? ORDER BY m.seq",
+                (user_id,)
+            ).fetchall()
+        for session_id, payload in rows:
+            by_id[session_id]["messages"].append(orjson.loads(payload))
+        return sessions
+
     def get_chat_session(self, session_id: str) -> Optional[Dict]:
         """Get specific chat session"""
-        sessions = self._load_data(self.chat_sessions_file)
-        return sessions.get(session_id)
-    
+        self.flush_messages()
+        session = self._get("chat_sessions", session_id)
+        if session is not None:
+            session["messages"] = self._session_messages(session_id)
+        return session
+
     def add_message_to_session(self, session_id: str, message: Dict):
-        """Add a message to a chat session"""
-        sessions = self._load_data(self.chat_sessions_file)
-        if session_id in sessions:
-            sessions[session_id]["messages"].append({
-                **message,
-                "timestamp": datetime.now().isoformat()
-            })
-            sessions[session_id]["updated_at"] = datetime.now().isoformat()
-            self._save_data(self.chat_sessions_file, sessions)
-    
+        """Add a message to a chat session (buffered until the next flush)"""
+        self.add_messages_to_session(session_id, [message])
+
+    def add_messages_to_session(self, session_id: str, messages: List[Dict]):
+        """Add several messages to a chat session at once, keeping any timestamps they carry"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._pending_messages.extend(
+                (session_id, {"timestamp": now, **message}) for message in messages
+            )
+
+    def flush_messages(self):
+        """Write all buffered chat messages in a single transaction"""
+        with self._lock:
+            if not self._pending_messages:
+                return
+            pending, self._pending_messages = self._pending_messages, []
+            with self.conn:
+                for session_id, message in pending:
+                    updated = self.conn.execute(
+                        "UPDATE chat_sessions SET data = json_set(data, '$.updated_at', ?) WHERE id = ?",
+                        (message["timestamp"], session_id)
+                    ).rowcount
+                    if updated:
+                        self._insert_message(session_id, message)
+
+    async def run_message_flusher(self, interval: float = 0.1):
+        """Background task that flushes buffered chat messages every `interval` seconds"""
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.flush_messages()
+        finally:
+            self.flush_messages()
+
     # Case study operations
     def create_case_study(self, case_study_data: Dict) -> str:
         """Create a new case study"""
-        case_studies = self._load_data(self.case_studies_file)
         case_study_id = str(uuid.uuid4())
-        
-        case_studies[case_study_id] = {
+
+        case_study = {
             **case_study_data,
             "id": case_study_id,
             "created_at": datetime.now().isoformat()
         }
-        
-        self._save_data(self.case_studies_file, case_studies)
+
+        self._save("case_studies", case_study_id, case_study)
         return case_study_id
-    
+
     def get_user_case_studies(self, user_id: str) -> List[Dict]:
         """Get all case studies for a user"""
-        case_studies = self._load_data(self.case_studies_file)
-        return [case_study for case_study in case_studies.values() if case_study.get("user_id") == user_id]
-    
+        return self._list("case_studies", "WHERE user_id = ?", (user_id,))
+
+    def count_user_case_studies_since(self, user_id: str, since: str) -> int:
+        """Count case studies a user created after an ISO timestamp"""
+        return self._count_since("case_studies", user_id, since)
+
     def get_case_study(self, case_study_id: str) -> Optional[Dict]:
         """Get specific case study"""
-        case_studies = self._load_data(self.case_studies_file)
-        return case_studies.get(case_study_id)
-    
+        return self._get("case_studies", case_study_id)
+
+    def delete_case_study(self, case_study_id: str) -> bool:
+        """Delete a case study"""
+        with self._lock, self.conn:
+            deleted = self.conn.execute(
+                "DELETE FROM case_studies WHERE id = ?", (case_study_id,)
+            ).rowcount
+        return deleted > 0
+
     # Lawyer operations
     def get_all_lawyers(self) -> List[Dict]:
         """Get all lawyers"""
-        lawyers = self._load_data(self.lawyers_file)
-        return list(lawyers.values())
-    
+        return self._list("lawyers")
+
     def get_online_lawyers(self) -> List[Dict]:
         """Get only online lawyers"""
-        lawyers = self._load_data(self.lawyers_file)
-        return [lawyer for lawyer in lawyers.values() if lawyer.get("is_online", False)]
-    
+        return [lawyer for lawyer in self._list("lawyers") if lawyer.get("is_online", False)]
+
     def get_lawyer(self, lawyer_id: str) -> Optional[Dict]:
         """Get specific lawyer"""
-        lawyers = self._load_data(self.lawyers_file)
-        return lawyers.get(lawyer_id)
-    
+        return self._get("lawyers", lawyer_id)
+
     # Booking operations
-    def create_booking(self, booking_data: Dict) -> str:
-        """Create a new booking"""
-        bookings = self._load_data(self.bookings_file)
+    def _slot_taken(self, lawyer_id: str, appointment_time: str) -> bool:
+        """Check whether a lawyer already has an active booking at a given time"""
+        return self.conn.execute(
+            "SELECT 1 FROM bookings WHERE json_extract(data, '$.lawyer_id') = ? "
+            "AND json_extract(data, '$.appointment_time') = ? "
+            "AND json_extract(data, '$.status') != 'cancelled' LIMIT 1",
+            (lawyer_id, appointment_time)
+        ).fetchone() is not None
+
+    def create_booking(self, booking_data: Dict) -> Optional[str]:
+        """Create a new booking, or return None if the lawyer's slot is already taken"""
         booking_id = str(uuid.uuid4())
-        
-        bookings[booking_id] = {
+
+        booking = {
             **booking_data,
             "id": booking_id,
             "status": "pending",
             "created_at": datetime.now().isoformat()
         }
-        
-        self._save_data(self.bookings_file, bookings)
+
+        # BEGIN IMMEDIATE takes the write lock up front so the conflict check and insert are atomic
+        with self._lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if self._slot_taken(booking["lawyer_id"], booking["appointment_time"]):
+                return None
+            self._put("bookings", booking_id, booking)
         return booking_id
-    
+
     def get_user_bookings(self, user_id: str) -> List[Dict]:
         """Get all bookings for a user"""
-        bookings = self._load_data(self.bookings_file)
-        return [booking for booking in bookings.values() if booking.get("user_id") == user_id]
-    
+        return self._list("bookings", "WHERE user_id = ?", (user_id,))
+
+    def count_user_bookings_since(self, user_id: str, since: str) -> int:
+        """Count bookings a user made after an ISO timestamp"""
+        return self._count_since("bookings", user_id, since)
+
+    def get_booking(self, booking_id: str, user_id: str) -> Optional[Dict]:
+        """Get a single booking owned by a user"""
+        bookings = self._list("bookings", "WHERE id = ? AND user_id = ?", (booking_id, user_id))
+        return bookings[0] if bookings else None
+
     def update_booking_status(self, booking_id: str, status: str) -> bool:
         """Update booking status"""
-        bookings = self._load_data(self.bookings_file)
-        if booking_id in bookings:
-            bookings[booking_id]["status"] = status
-            self._save_data(self.bookings_file, bookings)
-            return True
-        return False
-    
+        with self._lock, self.conn:
+            updated = self.conn.execute(
+                "UPDATE bookings SET data = json_set(data, '$.status', ?) WHERE id = ?",
+                (status, booking_id)
+            ).rowcount
+        return updated > 0
+
+    def reschedule_booking(self, booking_id: str, old_time: str, new_time: str) -> bool:
+        """Move a booking to a new time if it is unchanged since it was read and the slot is free"""
+        with self._lock, self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            booking = self._get("bookings", booking_id)
+            if booking is None or self._slot_taken(booking.get("lawyer_id"), new_time):
+                return False
+            # Compare-and-swap on the appointment time the caller validated against
+            updated = self.conn.execute(
+                "UPDATE bookings SET data = json_set(data, '$.appointment_time', ?) "
+                "WHERE id = ? AND json_extract(data, '$.appointment_time') = ?",
+                (new_time, booking_id, old_time)
+            ).rowcount
+        return updated > 0
+
     # Document Sets Management
     def store_document_set(self, document_set: Dict[str, Any]) -> str:
         """Store a new document set"""
-        document_sets = self._load_data(self.document_sets_file)
         document_set_id = document_set["id"]
-        document_sets[document_set_id] = document_set
-        self._save_data(self.document_sets_file, document_sets)
+        self._save("document_sets", document_set_id, document_set)
         return document_set_id
-    
+
     def get_document_set(self, document_set_id: str) -> Optional[Dict[str, Any]]:
         """Get document set by ID"""
-        document_sets = self._load_data(self.document_sets_file)
-        return document_sets.get(document_set_id)
-    
+        return self._get("document_sets", document_set_id)
+
     def get_user_document_sets(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all document sets for a user"""
-        document_sets = self._load_data(self.document_sets_file)
-        return [ds for ds in document_sets.values() if ds.get("user_id") == user_id]
-    
+        return self._list("document_sets", "WHERE user_id = ?", (user_id,))
+
     def delete_document_set(self, document_set_id: str) -> bool:
         """Delete a document set"""
-        document_sets = self._load_data(self.document_sets_file)
-        if document_set_id in document_sets:
-            del document_sets[document_set_id]
-            self._save_data(self.document_sets_file, document_sets)
-            return True
-        return False
+        with self._lock, self.conn:
+            deleted = self.conn.execute(
+                "DELETE FROM document_sets WHERE id = ?", (document_set_id,)
+            ).rowcount
+        return deleted > 0
 
 # Global database instance
-db = JSONDatabase(data_dir="data")
\ No newline at end of file
+db = JSONDatabase(data_dir="data")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from typing import Optional, List
 from datetime import datetime
 from enum import Enum
@@ -74,11 +74,32 @@ class LawyerAvailability(BaseModel):
     available_slots: List[datetime] = []
     is_online: bool = False
 
+def _to_naive_local(value: datetime) -> datetime:
+    """Convert timezone-aware times to naive local time, matching the stored bookings"""
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
 class BookingRequest(BaseModel):
     lawyer_id: str
     appointment_time: datetime
     description: Optional[str] = None
 
+    @field_validator("appointment_time")
+    @classmethod
+    def naive_appointment_time(cls, value: datetime) -> datetime:
+        return _to_naive_local(value)
+
+class RescheduleRequest(BaseModel):
+    new_appointment_time: datetime
+
+    @field_validator("new_appointment_time")
+    @classmethod
+    def naive_new_appointment_time(cls, value: datetime) -> datetime:
+        return _to_naive_local(value)
+
+class ExpertAdviceRequest(BaseModel):
+    query: str = Field(min_length=1, max_length=2000)
+    legal_area: str = "general"
+
 class BookingResponse(BaseModel):
     id: str
     user_id: str
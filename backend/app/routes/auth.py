@@ -3,6 +3,7 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from app.models.schemas import UserCreate, UserLogin, UserResponse, Token, SubscriptionTier
 from app.database.json_db import db
+from app.services.subscription import invalidate_subscription_info
 from app.utils.auth import (
     authenticate_user, 
     create_access_token, 
@@ -97,6 +98,7 @@ async def update_subscription(
 ):
     """Update user subscription tier"""
     db.update_user(current_user["id"], {"subscription_tier": subscription_tier.value})
+    invalidate_subscription_info(current_user["id"])
     updated_user = db.get_user_by_id(current_user["id"])
     
     return UserResponse(
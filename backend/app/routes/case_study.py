@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Form
 from typing import List, Optional
-from app.services.case_study import CaseStudyService
+from app.services.case_study import CaseStudyService, MAX_UPLOAD_BYTES
 from app.routes.auth import get_current_user
+from app.utils.errors import raise_for_error
 
 router = APIRouter(prefix="/case-study", tags=["case_study"])
 
@@ -26,18 +27,14 @@ async def analyze_document(
             detail=f"File type .{file_extension} not supported. Allowed types: {', '.join(allowed_extensions)}"
         )
     
-    # Check file size (10MB limit)
-    max_size = 10 * 1024 * 1024  # 10MB
-    file_content = await file.read()
-    if len(file_content) > max_size:
+    # Reject oversized files up front when the size is known; the service also enforces
+    # the 10MB limit while it streams the file to disk
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail="File size exceeds 10MB limit"
         )
     
-    # Reset file pointer
-    await file.seek(0)
-    
     result = await case_study_service.analyze_case_study(
         user_id=current_user["id"],
         file=file,
@@ -45,17 +42,7 @@ async def analyze_document(
         description=description
     )
     
-    if "error" in result:
-        if result.get("upgrade_required"):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=result["error"]
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=result["error"]
-            )
+    raise_for_error(result, status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     return result
 
@@ -73,11 +60,7 @@ async def get_case_study(
     """Get specific case study details"""
     case_study = case_study_service.get_case_study(case_study_id, current_user["id"])
     
-    if "error" in case_study:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=case_study["error"]
-        )
+    raise_for_error(case_study, status.HTTP_404_NOT_FOUND)
     
     return case_study
 
@@ -103,13 +86,9 @@ async def get_mind_map(
     current_user: dict = Depends(get_current_user)
 ):
     """Get mind map data for a case study"""
-    case_study = case_study_service.get_case_study(case_study_id, current_user["id"])
+    case_study = case_study_service.get_case_study(case_study_id, current_user["id"], include_text=False)
     
-    if "error" in case_study:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=case_study["error"]
-        )
+    raise_for_error(case_study, status.HTTP_404_NOT_FOUND)
     
     return {
         "mind_map_data": case_study.get("mind_map_data", {}),
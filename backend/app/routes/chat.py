@@ -1,17 +1,23 @@
 from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
+from functools import lru_cache
 from app.models.schemas import ChatMessage, ChatSession, ChatRequest
 from app.services.chat import LegalChatService
 from app.routes.auth import get_current_user
+from app.utils.errors import raise_for_error
 
 router = APIRouter(prefix="/chat", tags=["chat_advice"])
 
-chat_service = LegalChatService()
+@lru_cache(maxsize=1)
+def get_chat_service() -> LegalChatService:
+    return LegalChatService()
 
 @router.post("/advice")
 async def get_legal_advice(
     request: ChatRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    chat_service: LegalChatService = Depends(get_chat_service)
 ):
     """Get legal advice from AI assistant"""
     result = await chat_service.get_legal_advice(
@@ -20,22 +26,36 @@ async def get_legal_advice(
         session_id=request.session_id
     )
     
-    if "error" in result:
-        if result.get("upgrade_required"):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=result["error"]
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=result["error"]
-            )
+    raise_for_error(result, status.HTTP_500_INTERNAL_SERVER_ERROR)
     
     return result
 
+@router.post("/advice/stream")
+async def stream_legal_advice(
+    request: ChatRequest,
+    current_user: dict = Depends(get_current_user),
+    chat_service: LegalChatService = Depends(get_chat_service)
+):
+    """Stream legal advice from AI assistant as plain text"""
+    advice = chat_service.start_legal_advice(
+        user_id=current_user["id"],
+        message=request.message,
+        session_id=request.session_id
+    )
+    
+    raise_for_error(advice, status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    return StreamingResponse(
+        chat_service.stream_legal_advice(advice, request.message),
+        media_type="text/plain",
+        headers={"X-Session-Id": advice["session_id"], "X-Legal-Area": advice["legal_area"]}
+    )
+
 @router.get("/history")
-async def get_chat_history(current_user: dict = Depends(get_current_user)):
+async def get_chat_history(
+    current_user: dict = Depends(get_current_user),
+    chat_service: LegalChatService = Depends(get_chat_service)
+):
     """Get user's chat session history"""
     history = chat_service.get_chat_history(current_user["id"])
     return {"sessions": history}
@@ -43,16 +63,13 @@ async def get_chat_history(current_user: dict = Depends(get_current_user)):
 @router.get("/session/{session_id}")
 async def get_chat_session(
     session_id: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    chat_service: LegalChatService = Depends(get_chat_service)
 ):
     """Get specific chat session"""
     session = chat_service.get_chat_session(session_id, current_user["id"])
     
-    if "error" in session:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=session["error"]
-        )
+    raise_for_error(session, status.HTTP_404_NOT_FOUND)
     
     return session
 
@@ -61,7 +78,8 @@ async def mark_step_completed(
     session_id: str,
     step_number: int,
     message_index: int = 0,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    chat_service: LegalChatService = Depends(get_chat_service)
 ):
     """Mark a specific step as completed"""
     success = chat_service.mark_step_completed(session_id, message_index, step_number)
@@ -1,16 +1,25 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi import APIRouter, status, Depends, Query
 from typing import List, Optional
+from functools import lru_cache
+from fastapi_cache.decorator import cache
 from app.services.expert_advice import ExpertAdviceService
 from app.routes.auth import get_current_user
+from app.utils.errors import raise_for_error
+from app.models.schemas import BookingRequest, RescheduleRequest, ExpertAdviceRequest
+from app.utils.cache import LAWYERS_CACHE_EXPIRE, SPECIALIZATIONS_CACHE_EXPIRE, user_key_builder
 
 router = APIRouter(prefix="/expert-advice", tags=["expert_advice"])
 
-expert_service = ExpertAdviceService()
+@lru_cache(maxsize=1)
+def get_expert_service() -> ExpertAdviceService:
+    return ExpertAdviceService()
 
 @router.get("/lawyers")
+@cache(expire=LAWYERS_CACHE_EXPIRE, key_builder=user_key_builder)
 async def get_available_lawyers(
     specialization: Optional[str] = Query(None, description="Filter by lawyer specialization"),
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    expert_service: ExpertAdviceService = Depends(get_expert_service)
 ):
     """Get available lawyers based on user's subscription"""
     result = expert_service.get_available_lawyers(
@@ -18,107 +27,74 @@ async def get_available_lawyers(
         specialization=specialization
     )
     
-    if "error" in result:
-        if result.get("upgrade_required"):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=result["error"]
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=result["error"]
-            )
+    raise_for_error(result)
     
     return result
 
 @router.get("/lawyers/online")
-async def get_online_lawyers(current_user: dict = Depends(get_current_user)):
+@cache(expire=LAWYERS_CACHE_EXPIRE, key_builder=user_key_builder)
+async def get_online_lawyers(
+    current_user: dict = Depends(get_current_user),
+    expert_service: ExpertAdviceService = Depends(get_expert_service)
+):
     """Get only online lawyers"""
     result = expert_service.get_online_lawyers(current_user["id"])
     
-    if "error" in result:
-        if result.get("upgrade_required"):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=result["error"]
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=result["error"]
-            )
+    raise_for_error(result)
     
     return result
 
 @router.get("/specializations")
-async def get_specializations():
+@cache(expire=SPECIALIZATIONS_CACHE_EXPIRE)
+async def get_specializations(
+    expert_service: ExpertAdviceService = Depends(get_expert_service)
+):
     """Get list of all lawyer specializations"""
     specializations = expert_service.get_lawyer_specializations()
     return {"specializations": specializations}
 
 @router.post("/")
 async def get_expert_advice(
-    request: dict,
-    current_user: dict = Depends(get_current_user)
+    request: ExpertAdviceRequest,
+    current_user: dict = Depends(get_current_user),
+    expert_service: ExpertAdviceService = Depends(get_expert_service)
 ):
     """Get expert legal advice based on query and legal area"""
-    query = request.get("query", "")
-    legal_area = request.get("legal_area", "general")
-    
     # For now, return a structured advice response
     # This could be enhanced to connect with actual experts or AI
     result = expert_service.get_expert_advice_response(
         user_id=current_user["id"],
-        query=query,
-        legal_area=legal_area
+        query=request.query,
+        legal_area=request.legal_area
     )
     
-    if "error" in result:
-        if result.get("upgrade_required"):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=result["error"]
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=result["error"]
-            )
+    raise_for_error(result)
     
     return result
 
 @router.post("/book")
 async def book_consultation(
-    lawyer_id: str,
-    appointment_time: str,
-    description: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    request: BookingRequest,
+    current_user: dict = Depends(get_current_user),
+    expert_service: ExpertAdviceService = Depends(get_expert_service)
 ):
     """Book a consultation with a lawyer"""
     result = expert_service.book_consultation(
         user_id=current_user["id"],
-        lawyer_id=lawyer_id,
-        appointment_time=appointment_time,
-        description=description
+        lawyer_id=request.lawyer_id,
+        appointment_time=request.appointment_time.isoformat(),
+        description=request.description
     )
     
-    if "error" in result:
-        if result.get("upgrade_required"):
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=result["error"]
-            )
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=result["error"]
-            )
+    raise_for_error(result)
     
     return result
 
 @router.get("/bookings")
-async def get_my_bookings(current_user: dict = Depends(get_current_user)):
+async def get_my_bookings(
+    current_user: dict = Depends(get_current_user),
+    expert_service: ExpertAdviceService = Depends(get_expert_service)
+):
     """Get all bookings for the current user"""
     bookings = expert_service.get_user_bookings(current_user["id"])
     return {"bookings": bookings}
@@ -126,52 +102,43 @@ async def get_my_bookings(current_user: dict = Depends(get_current_user)):
 @router.get("/bookings/{booking_id}")
 async def get_booking_details(
     booking_id: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    expert_service: ExpertAdviceService = Depends(get_expert_service)
 ):
     """Get detailed information about a specific booking"""
     booking = expert_service.get_booking_details(booking_id, current_user["id"])
     
-    if "error" in booking:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=booking["error"]
-        )
+    raise_for_error(booking, status.HTTP_404_NOT_FOUND)
     
     return booking
 
 @router.put("/bookings/{booking_id}/cancel")
 async def cancel_booking(
     booking_id: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: dict = Depends(get_current_user),
+    expert_service: ExpertAdviceService = Depends(get_expert_service)
 ):
     """Cancel a booking"""
     result = expert_service.cancel_booking(booking_id, current_user["id"])
     
-    if "error" in result:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=result["error"]
-        )
+    raise_for_error(result)
     
     return result
 
 @router.put("/bookings/{booking_id}/reschedule")
 async def reschedule_booking(
     booking_id: str,
-    new_appointment_time: str,
-    current_user: dict = Depends(get_current_user)
+    request: RescheduleRequest,
+    current_user: dict = Depends(get_current_user),
+    expert_service: ExpertAdviceService = Depends(get_expert_service)
 ):
     """Reschedule an existing booking"""
     result = expert_service.reschedule_booking(
         booking_id=booking_id,
         user_id=current_user["id"],
-        new_appointment_time=new_appointment_time
+        new_appointment_time=request.new_appointment_time.isoformat()
     )
     
-    if "error" in result:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=result["error"]
-        )
+    raise_for_error(result)
     
     return result
\ No newline at end of file
@@ -1,5 +1,7 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
 from typing import List, Dict, Any
+from functools import lru_cache
+import asyncio
 import os
 import aiofiles
 from pathlib import Path
@@ -9,56 +11,70 @@ from app.routes.auth import get_current_user
 
 router = APIRouter(prefix="/rag", tags=["RAG"])
 
+# Uploads are streamed to disk in 1 MiB chunks
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+ALLOWED_EXTENSIONS = frozenset({'.pdf', '.docx', '.doc'})
+
+# Query guards, checked by FastAPI before any embedding or Pinecone work is scheduled
+MAX_QUERY_LENGTH = 4000
+NAMESPACE_PATTERN = r"^[a-zA-Z0-9_\-]{1,64}$"
+MAX_QUERY_RESULTS = 10
+
 # Initialize service lazily to prevent startup blocking
-_rag_service = None
+@lru_cache(maxsize=1)
+def get_rag_service() -> RAGService:
+    return RAGService()
 
-def get_rag_service():
-    global _rag_service
-    if _rag_service is None:
-        _rag_service = RAGService()
-    return _rag_service
+async def _save_upload(file: UploadFile, file_path: str) -> None:
+    """Stream one uploaded file to disk"""
+    async with aiofiles.open(file_path, 'wb') as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
 
 @router.post("/upload")
 async def upload_documents(
     files: List[UploadFile] = File(...),
-    current_user: Dict = Depends(get_current_user)
+    current_user: Dict = Depends(get_current_user),
+    rag_service: RAGService = Depends(get_rag_service)
 ) -> Dict[str, Any]:
     """Upload and process documents for RAG"""
     
-    # Validate file types
-    allowed_extensions = {'.pdf', '.docx', '.doc'}
     uploaded_files = []
+    uploads = {}  # file path -> upload
     
     try:
         # Create user uploads directory
         user_upload_dir = Path(f"uploads/user_{current_user['id']}")
         user_upload_dir.mkdir(parents=True, exist_ok=True)
         
-        # Save uploaded files
+        # Validate all files before writing any of them
         for file in files:
             if not file.filename:
                 continue
                 
-            file_ext = os.path.splitext(file.filename)[1].lower()
-            if file_ext not in allowed_extensions:
+            file_ext = Path(file.filename).suffix.lower()
+            if file_ext not in ALLOWED_EXTENSIONS:
                 raise HTTPException(
                     status_code=400,
-                    detail=f"Unsupported file type: {file_ext}. Allowed: {', '.join(allowed_extensions)}"
+                    detail=f"Unsupported file type: {file_ext}. Allowed: {', '.join(sorted(ALLOWED_EXTENSIONS))}"
                 )
             
-            file_path = user_upload_dir / file.filename
-            
-            async with aiofiles.open(file_path, 'wb') as f:
-                content = await file.read()
-                await f.write(content)
-            
-            uploaded_files.append(str(file_path))
+            file_path = str(user_upload_dir / file.filename)
+            if file_path in uploads:
+                # Concurrent writes to one path would interleave their bytes
+                raise HTTPException(status_code=400, detail=f"Duplicate file name: {file.filename}")
+            uploads[file_path] = file
+        
+        # Save uploaded files concurrently
+        uploaded_files = list(uploads)
+        await asyncio.gather(*(_save_upload(file, file_path) for file_path, file in uploads.items()))
         
         if not uploaded_files:
             raise HTTPException(status_code=400, detail="No valid files uploaded")
         
         # Process documents with RAG service
-        result = await get_rag_service().process_and_store_documents(
+        result = await rag_service.process_and_store_documents(
             uploaded_files, 
             current_user["id"]
         )
@@ -85,21 +101,22 @@ async def upload_documents(
 
 @router.post("/query")
 async def query_documents(
-    namespace: str = Form(...),
-    query: str = Form(...),
+    namespace: str = Form(..., pattern=NAMESPACE_PATTERN),
+    query: str = Form(..., max_length=MAX_QUERY_LENGTH),
     k: int = Form(5),
-    current_user: Dict = Depends(get_current_user)
+    current_user: Dict = Depends(get_current_user),
+    rag_service: RAGService = Depends(get_rag_service)
 ) -> Dict[str, Any]:
     """Query documents using RAG"""
     
     if not query.strip():
         raise HTTPException(status_code=400, detail="Query cannot be empty")
     
-    result = await get_rag_service().query_documents(
+    result = await rag_service.query_documents(
         query=query,
         namespace=namespace,
         user_id=current_user["id"],
-        k=min(k, 10)  # Limit to max 10 results
+        k=max(1, min(k, MAX_QUERY_RESULTS))  # Limit to 1-10 results
     )
     
     if not result["success"]:
@@ -115,11 +132,12 @@ async def query_documents(
 
 @router.get("/document-sets")
 async def get_document_sets(
-    current_user: Dict = Depends(get_current_user)
+    current_user: Dict = Depends(get_current_user),
+    rag_service: RAGService = Depends(get_rag_service)
 ) -> Dict[str, Any]:
     """Get all document sets for the current user"""
     
-    document_sets = get_rag_service().get_user_document_sets(current_user["id"])
+    document_sets = rag_service.get_user_document_sets(current_user["id"])
     
     # Format for frontend
     formatted_sets = []
@@ -141,11 +159,12 @@ async def get_document_sets(
 @router.delete("/document-sets/{namespace}")
 async def delete_document_set(
     namespace: str,
-    current_user: Dict = Depends(get_current_user)
+    current_user: Dict = Depends(get_current_user),
+    rag_service: RAGService = Depends(get_rag_service)
 ) -> Dict[str, Any]:
     """Delete a document set"""
     
-    result = get_rag_service().delete_document_set(namespace, current_user["id"])
+    result = rag_service.delete_document_set(namespace, current_user["id"])
     
     if not result["success"]:
         raise HTTPException(status_code=400, detail=result["error"])
@@ -1,8 +1,12 @@
+import io
+import orjson
 import os
 import asyncio
 import uuid
 import re
-from typing import List, Dict, Any, Optional
+from collections import Counter
+from typing import List, Dict, Any, Optional, Union
+from typing_extensions import TypedDict
 from pathlib import Path
 import aiofiles
 from fastapi import UploadFile
@@ -14,7 +18,7 @@ import sys
 sys.path.append(str(Path(__file__).parent.parent.parent.parent / "Final"))
 
 from app.database.json_db import db
-from app.services.subscription import SubscriptionService
+from app.services.subscription import get_subscription_service, invalidate_subscription_info
 
 # Configure Gemini API
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
@@ -22,11 +26,46 @@ genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 # Use Gemini 1.5 Pro Latest for best document analysis quality
 GEMINI_MODEL = "gemini-1.5-pro-latest"
 
+# Shared model handle, built once per process instead of per request
+_MODEL = genai.GenerativeModel(GEMINI_MODEL)
+
+# Uploads are streamed to disk in 1 MiB chunks, and rejected once they pass 10MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+WORD_RE = re.compile(r"[a-z]+")
+
+# Token budget for document text sent to Gemini, and a rough chars-per-token ratio for the first cut
+MAX_DOCUMENT_TOKENS = 30000
+CHARS_PER_TOKEN_ESTIMATE = 4
+
+class MindMapBranch(TypedDict):
+    name: str
+    details: str
+
+class DocumentAnalysis(TypedDict):
+    """Response schema for the single structured document-analysis call"""
+    summary: str
+    highlights: List[str]
+    mind_map_branches: List[MindMapBranch]
+
+def _extract_pdf_text(source: Union[str, bytes]) -> str:
+    """Extract PDF text from a path or in-memory bytes with PyMuPDF (C-backed), falling back to PyPDF2"""
+    try:
+        import fitz
+        doc = fitz.open(stream=source, filetype="pdf") if isinstance(source, bytes) else fitz.open(source)
+        with doc:
+            return "\n".join(page.get_text() for page in doc)
+    except ImportError:
+        import PyPDF2
+        reader = PyPDF2.PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+        return "\n".join(page.extract_text() for page in reader.pages)
+
 class CaseStudyService:
     """Service for handling custom case study analysis using RAG pipeline"""
     
     def __init__(self):
-        self.subscription_service = SubscriptionService(db)
+        self.subscription_service = get_subscription_service()
         self.uploads_dir = Path("uploads")
         self.uploads_dir.mkdir(exist_ok=True)
     
@@ -55,13 +94,29 @@ class CaseStudyService:
             saved_filename = f"{file_id}{file_extension}"
             file_path = self.uploads_dir / saved_filename
             
-            # Save file
+            # Save file, keeping the bytes so extraction doesn't read it back from disk;
+            # the size limit is enforced on this same pass
+            content = bytearray()
             async with aiofiles.open(file_path, 'wb') as f:
-                content = await file.read()
-                await f.write(content)
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    content += chunk
+                    if len(content) > MAX_UPLOAD_BYTES:
+                        break
+                    await f.write(chunk)
+            
+            if len(content) > MAX_UPLOAD_BYTES:
+                file_path.unlink()
+                return {"error": "File size exceeds 10MB limit", "file_too_large": True}
             
             # Process document using RAG pipeline
-            analysis_result = await self._process_document(str(file_path), file.filename)
+            analysis_result = await self._process_document(str(file_path), file.filename, bytes(content))
+            
+            # Keep the (potentially large) extracted text out of the DB record
+            text_dir = self.uploads_dir / f"user_{user_id}"
+            text_dir.mkdir(parents=True, exist_ok=True)
+            text_path = text_dir / f"{file_id}.txt"
+            async with aiofiles.open(text_path, 'w', encoding='utf-8') as f:
+                await f.write(analysis_result.get("extracted_text", ""))
             
             # Create case study record
             case_study_data = {
@@ -74,11 +129,12 @@ class CaseStudyService:
                 "summary": analysis_result.get("summary", ""),
                 "highlights": analysis_result.get("highlights", []),
                 "mind_map_data": analysis_result.get("mind_map", {}),
-                "extracted_text": analysis_result.get("extracted_text", ""),
+                "extracted_text_path": str(text_path),
                 "analysis_metadata": analysis_result.get("metadata", {})
             }
             
             case_study_id = db.create_case_study(case_study_data)
+            invalidate_subscription_info(user_id)
             
             return {
                 "case_study_id": case_study_id,
@@ -101,7 +157,12 @@ class CaseStudyService:
                 "details": "Document processing failed during analysis"
             }
     
-    async def _process_document(self, file_path: str, original_filename: str) -> Dict[str, Any]:
+    async def _process_document(
+        self, 
+        file_path: str, 
+        original_filename: str, 
+        content: Optional[bytes] = None
+    ) -> Dict[str, Any]:
         """Process document using RAG pipeline"""
         try:
             # Import and use components from existing RAG pipeline
@@ -115,14 +176,17 @@ class CaseStudyService:
             # Extract text from document
             extracted_text = await extract_text_from_file(file_path)
             
-            # Create summary
-            summary = await create_summary(extracted_text)
+            # Create summary, then the mind map data structure that depends on it
+            async def summarize_and_map():
+                summary = await create_summary(extracted_text)
+                mind_map = await self._generate_mind_map(extracted_text, summary)
+                return summary, mind_map
             
-            # Identify important highlights
-            highlights = await identify_highlights(extracted_text)
-            
-            # Generate mind map data structure
-            mind_map = await self._generate_mind_map(extracted_text, summary)
+            # Identify important highlights concurrently with the summary chain
+            (summary, mind_map), highlights = await asyncio.gather(
+                summarize_and_map(),
+                identify_highlights(extracted_text)
+            )
             
             return {
                 "extracted_text": extracted_text,
@@ -139,26 +203,32 @@ class CaseStudyService:
             
         except Exception as e:
             # Fallback to basic processing if RAG pipeline fails
-            return await self._basic_document_processing(file_path, original_filename)
+            return await self._basic_document_processing(
+                content if content is not None else file_path, 
+                original_filename
+            )
     
-    async def _basic_document_processing(self, file_path: str, original_filename: str) -> Dict[str, Any]:
-        """Basic document processing with Gemini AI analysis"""
+    async def _basic_document_processing(self, source: Union[str, bytes], original_filename: str) -> Dict[str, Any]:
+        """Basic document processing with Gemini AI analysis
+
+        `source` is either a path on disk or the file's bytes already in memory.
+        """
         try:
+            # Pick the extractor from the path, or from the original name for in-memory bytes
+            name = (source if isinstance(source, str) else original_filename).lower()
+            
             # Basic text extraction
-            if file_path.lower().endswith('.pdf'):
+            if name.endswith('.pdf'):
                 try:
-                    import PyPDF2
-                    reader = PyPDF2.PdfReader(file_path)
-                    text = ""
-                    for page in reader.pages:
-                        text += page.extract_text() + "\n"
+                    # Extraction is CPU-bound; keep it off the event loop
+                    text = await asyncio.to_thread(_extract_pdf_text, source)
                 except ImportError:
-                    return self._create_error_response(original_filename, "PyPDF2 not available for PDF processing")
+                    return self._create_error_response(original_filename, "PyMuPDF or PyPDF2 required for PDF processing")
             
-            elif file_path.lower().endswith(('.doc', '.docx')):
+            elif name.endswith(('.doc', '.docx')):
                 try:
                     from docx import Document
-                    doc = Document(file_path)
+                    doc = Document(io.BytesIO(source) if isinstance(source, bytes) else source)
                     text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
                 except ImportError:
                     return self._create_error_response(original_filename, "python-docx not available for Word processing")
@@ -166,8 +236,11 @@ class CaseStudyService:
             else:
                 # Try to read as text file
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        text = f.read()
+                    if isinstance(source, bytes):
+                        text = source.decode('utf-8')
+                    else:
+                        with open(source, 'r', encoding='utf-8') as f:
+                            text = f.read()
                 except Exception as e:
                     return self._create_error_response(original_filename, f"Failed to read file: {str(e)}")
             
@@ -180,44 +253,45 @@ class CaseStudyService:
         except Exception as e:
             return self._create_error_response(original_filename, str(e))
     
+    async def _truncate_to_tokens(self, text: str, max_tokens: int = MAX_DOCUMENT_TOKENS) -> str:
+        """Trim text to fit a token budget, measured with the model's own tokenizer"""
+        candidate = text[:max_tokens * CHARS_PER_TOKEN_ESTIMATE]
+        if len(candidate) > max_tokens:  # a token is at least one character, so short texts always fit
+            token_count = (await _MODEL.count_tokens_async(candidate)).total_tokens
+            if token_count > max_tokens:
+                candidate = candidate[:int(len(candidate) * max_tokens / token_count)]
+        return candidate
+    
     async def _analyze_with_gemini(self, text: str, original_filename: str) -> Dict[str, Any]:
-        """Use Gemini AI to analyze the document text"""
+        """Use Gemini AI to analyze the document text in a single structured call"""
         try:
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            
-            # Create summary
-            summary_prompt = f"""
-            Analyze this legal document and provide a concise summary in 2-3 sentences:
-            
-            {text[:3000]}  # Limit text to avoid token limits
-            """
-            
-            summary_response = model.generate_content(summary_prompt)
-            summary = summary_response.text
-            
-            # Extract key highlights
-            highlights_prompt = f"""
-            From this legal document, extract 5 key legal points or important clauses. 
-            Return each point as a separate line starting with a number:
-            
-            {text[:3000]}
+            model = _MODEL
+            document = await self._truncate_to_tokens(text)
+            
+            # Summary, highlights and mind-map branches in one request
+            analysis_prompt = f"""
+            Analyze this legal document and return JSON with:
+            - summary: a concise summary in 2-3 sentences
+            - highlights: 5 key legal points or important clauses, one per item
+            - mind_map_branches: 3-5 main branches for a mind map of the document, focusing on
+              legal concepts, parties, obligations, and key terms; each with a short name and details
+            
+            Document:
+            <<<{document}>>>
             """
             
-            highlights_response = model.generate_content(highlights_prompt)
-            highlights_text = highlights_response.text
-            
-            # Parse highlights
-            highlights = []
-            for line in highlights_text.split('\n'):
-                line = line.strip()
-                if line and (line[0].isdigit() or line.startswith('-') or line.startswith('•')):
-                    # Clean up the line
-                    cleaned_line = re.sub(r'^\d+\.?\s*|\-\s*|•\s*', '', line).strip()
-                    if cleaned_line:
-                        highlights.append(cleaned_line)
+            response = await model.generate_content_async(
+                analysis_prompt,
+                generation_config=genai.GenerationConfig(
+                    response_mime_type="application/json",
+                    response_schema=DocumentAnalysis
+                )
+            )
+            analysis = orjson.loads(response.text)
             
-            # Generate mind map with Gemini
-            mind_map = await self._generate_mind_map_with_gemini(text[:2000], summary)
+            summary = analysis.get("summary", "")
+            highlights = [h.strip() for h in analysis.get("highlights", []) if h and h.strip()]
+            mind_map = self._build_mind_map(summary, analysis.get("mind_map_branches", []))
             
             return {
                 "extracted_text": text,
@@ -236,69 +310,36 @@ class CaseStudyService:
         except Exception as e:
             return self._create_error_response(original_filename, f"Gemini analysis failed: {str(e)}")
     
-    async def _generate_mind_map_with_gemini(self, text: str, summary: str) -> Dict[str, Any]:
-        """Generate mind map using Gemini AI"""
-        try:
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            
-            mind_map_prompt = f"""
-            Create a mind map structure for this legal document. Return a JSON-like structure with:
-            1. A central topic
-            2. 3-5 main branches with subtopics
-            3. Focus on legal concepts, parties, obligations, and key terms
-            
-            Document summary: {summary}
-            Document text: {text}
-            
-            Format as: Main Topic -> Branch 1, Branch 2, etc.
-            """
-            
-            response = model.generate_content(mind_map_prompt)
-            mind_map_text = response.text
-            
-            # Create a structured mind map from the AI response
-            mind_map = {
-                "title": "Legal Document Analysis",
-                "center_node": {
-                    "name": "Document Overview",
-                    "summary": summary[:200] + "..." if len(summary) > 200 else summary
-                },
-                "branches": []
-            }
-            
-            # Parse the AI response to extract branches
-            lines = mind_map_text.split('\n')
-            for line in lines:
-                line = line.strip()
-                if '->' in line or any(keyword in line.lower() for keyword in ['branch', 'topic', 'concept', 'party', 'obligation']):
-                    branch_name = line.split('->')[0].strip() if '->' in line else line
-                    branch_name = re.sub(r'^\d+\.?\s*|\-\s*|•\s*', '', branch_name).strip()
-                    if branch_name and len(branch_name) > 3:
-                        mind_map["branches"].append({
-                            "name": branch_name[:50],  # Limit length
-                            "weight": 5,
-                            "details": "Generated by AI analysis"
-                        })
-            
-            # If no branches found, create default ones
-            if not mind_map["branches"]:
-                mind_map["branches"] = [
-                    {"name": "Key Legal Points", "weight": 8, "details": "Main legal concepts"},
-                    {"name": "Parties Involved", "weight": 6, "details": "Entities mentioned"},
-                    {"name": "Obligations", "weight": 7, "details": "Legal duties and requirements"},
-                    {"name": "Important Dates", "weight": 5, "details": "Timeline elements"}
-                ]
-            
-            return mind_map
-            
-        except Exception as e:
-            # Fallback to simple mind map
-            return {
-                "title": "Document Analysis",
-                "center_node": {"name": "Legal Document", "summary": summary[:100]},
-                "branches": [{"name": "Analysis Available", "weight": 5, "details": f"AI processing error: {str(e)}"}],
-                "error": str(e)
-            }
+    def _build_mind_map(self, summary: str, branches: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Build the mind map structure from Gemini's branches"""
+        mind_map = {
+            "title": "Legal Document Analysis",
+            "center_node": {
+                "name": "Document Overview",
+                "summary": summary[:200] + "..." if len(summary) > 200 else summary
+            },
+            "branches": []
+        }
+        
+        for branch in branches:
+            branch_name = (branch.get("name") or "").strip()
+            if branch_name and len(branch_name) > 3:
+                mind_map["branches"].append({
+                    "name": branch_name[:50],  # Limit length
+                    "weight": 5,
+                    "details": branch.get("details") or "Generated by AI analysis"
+                })
+        
+        # If no branches found, create default ones
+        if not mind_map["branches"]:
+            mind_map["branches"] = [
+                {"name": "Key Legal Points", "weight": 8, "details": "Main legal concepts"},
+                {"name": "Parties Involved", "weight": 6, "details": "Entities mentioned"},
+                {"name": "Obligations", "weight": 7, "details": "Legal duties and requirements"},
+                {"name": "Important Dates", "weight": 5, "details": "Timeline elements"}
+            ]
+        
+        return mind_map
     
     def _create_error_response(self, filename: str, error_message: str) -> Dict[str, Any]:
         """Create a standardized error response"""
@@ -320,15 +361,16 @@ class CaseStudyService:
         # Simple mind map generation
         # In production, this could be enhanced with more sophisticated NLP
         
-        words = text.lower().split()
+        # Count every word once; punctuation is stripped so "contract," still matches
+        counts = Counter(WORD_RE.findall(text.lower()))
         
         # Count important legal terms
         legal_terms = {
-            "contract": words.count("contract") + words.count("agreement"),
-            "liability": words.count("liability") + words.count("damages"),
-            "rights": words.count("rights") + words.count("obligations"),
-            "breach": words.count("breach") + words.count("violation"),
-            "payment": words.count("payment") + words.count("compensation")
+            "contract": counts["contract"] + counts["agreement"],
+            "liability": counts["liability"] + counts["damages"],
+            "rights": counts["rights"] + counts["obligations"],
+            "breach": counts["breach"] + counts["violation"],
+            "payment": counts["payment"] + counts["compensation"]
         }
         
         # Create mind map structure
@@ -359,12 +401,13 @@ class CaseStudyService:
         # Remove sensitive file paths and add summary info
         for study in case_studies:
             study.pop("file_path", None)
-            study.pop("extracted_text", None)  # Don't return full text in list
+            study.pop("extracted_text_path", None)
+            study.pop("extracted_text", None)  # Records created before text was stored separately
         
         return case_studies
     
-    def get_case_study(self, case_study_id: str, user_id: str) -> Dict[str, Any]:
-        """Get specific case study"""
+    def get_case_study(self, case_study_id: str, user_id: str, include_text: bool = True) -> Dict[str, Any]:
+        """Get specific case study, loading the extracted text only when requested"""
         case_study = db.get_case_study(case_study_id)
         
         if not case_study:
@@ -373,8 +416,18 @@ class CaseStudyService:
         if case_study.get("user_id") != user_id:
             return {"error": "Access denied"}
         
-        # Remove sensitive file path
+        # Remove sensitive file paths
         case_study.pop("file_path", None)
+        text_path = case_study.pop("extracted_text_path", None)
+        
+        if not include_text:
+            case_study.pop("extracted_text", None)
+        elif text_path:
+            try:
+                with open(text_path, 'r', encoding='utf-8') as f:
+                    case_study["extracted_text"] = f.read()
+            except OSError:
+                case_study["extracted_text"] = ""
         
         return case_study
     
@@ -385,14 +438,14 @@ class CaseStudyService:
         if not case_study or case_study.get("user_id") != user_id:
             return False
         
-        # Delete file if it exists
-        file_path = case_study.get("file_path")
-        if file_path and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception:
-                pass  # Continue even if file deletion fails
+        # Delete uploaded file and extracted text if they exist
+        for file_path in (case_study.get("file_path"), case_study.get("extracted_text_path")):
+            if file_path and os.path.exists(file_path):
+                try:
+                    os.remove(file_path)
+                except Exception:
+                    pass  # Continue even if file deletion fails
         
-        # Remove from database (this would need to be implemented in json_db)
-        # For now, we'll just return True
-        return True
\ No newline at end of file
+        deleted = db.delete_case_study(case_study_id)
+        invalidate_subscription_info(user_id)
+        return deleted
\ No newline at end of file
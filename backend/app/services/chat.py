@@ -1,10 +1,18 @@
 import google.generativeai as genai
+import asyncio
+import hashlib
 import re
-from typing import List, Dict, Any
+from typing import AsyncIterator, List, Dict, Any
 from datetime import datetime
 import os
+from cachetools import TTLCache
 from app.database.json_db import db
-from app.services.subscription import SubscriptionService
+from app.services.subscription import get_subscription_service
+
+try:
+    import ahocorasick
+except ImportError:  # optional; identify_legal_area falls back to one compiled regex
+    ahocorasick = None
 
 # Configure Gemini API
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -17,11 +25,55 @@ else:
 # Use a stable Gemini model
 GEMINI_MODEL = "gemini-1.5-pro"
 
+# Step markers ("1.", "-", "•", "Step 2:") at the start of a line; splitting on them yields the steps
+# (spelled with character classes rather than re.IGNORECASE, so the pattern stays case-sensitive)
+STEP_SPLIT_RE = re.compile(r'^[ \t]*(?:\d+\.|-|•|[Ss][Tt][Ee][Pp][ \t]+\d+:?)', re.MULTILINE)
+
+# Static guidelines, sent once as the model's system instruction rather than inlined into every prompt
+SYSTEM_INSTRUCTION = """You are a legal advice assistant. Provide step-by-step legal guidance in a clear, structured format. 
+
+Guidelines:
+1. Break down advice into numbered steps when appropriate
+2. Be specific and actionable
+3. Include relevant legal considerations
+4. Mention when professional legal consultation is recommended
+5. Focus on the legal area named in the request if relevant
+6. Do not provide definitive legal conclusions
+7. Always recommend consulting with a qualified attorney for complex matters
+
+Format your response with clear, actionable steps when possible."""
+
+# Shared model handle, built once per process instead of per request
+_MODEL = genai.GenerativeModel(GEMINI_MODEL, system_instruction=SYSTEM_INSTRUCTION)
+
+# Gemini answers for repeated questions, keyed by a hash of model, legal area and normalized message
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 3600
+
+# Keywords for different legal areas, in priority order
+LEGAL_AREA_KEYWORDS = (
+    ("labor_law", ("employment", "unemployment", "workplace", "wages", "discrimination", "firing", "hiring", "overtime")),
+    ("consumer_protection", ("consumer", "fraud", "scam", "warranty", "refund", "purchase")),
+    ("immigration", ("visa", "citizenship", "deportation", "immigration", "green card")),
+    ("family_law", ("divorce", "custody", "marriage", "adoption", "child support", "alimony")),
+    ("criminal_law", ("criminal", "arrest", "charges", "felony", "misdemeanor", "court")),
+    ("civil_rights", ("discrimination", "civil rights", "harassment", "freedom")),
+    ("intellectual_property", ("patent", "trademark", "copyright", "intellectual property")),
+    ("business_law", ("business", "corporation", "contract", "llc", "partnership"))
+)
+
+def _starts_word(text: str, start: int) -> bool:
+    """Check that text[start] begins a word (suffixes after a match are allowed)"""
+    return start == 0 or not _is_word_char(text[start - 1])
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
 class LegalChatService:
     """Service for handling legal advice chat with step-by-step responses"""
     
     def __init__(self):
-        self.subscription_service = SubscriptionService(db)
+        self.subscription_service = get_subscription_service()
         self.government_links = {
             "labor_law": [
                 "https://www.dol.gov/general/topic/wages",
@@ -57,28 +109,60 @@ class LegalChatService:
                 "https://www.sec.gov/"
             ]
         }
+        self._build_keyword_matcher()
+        self._response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+        # Gemini calls currently running, by response cache key, so identical concurrent questions share one
+        self._in_flight: Dict[str, asyncio.Future] = {}
+    
+    def _build_keyword_matcher(self):
+        """Build a single-pass matcher over all legal-area keywords"""
+        self._area_rank = {area: rank for rank, (area, _) in enumerate(LEGAL_AREA_KEYWORDS)}
+        
+        # Keywords listed under several areas belong to the first (highest-priority) one
+        keyword_areas = {}
+        for area, keywords in LEGAL_AREA_KEYWORDS:
+            for keyword in keywords:
+                keyword_areas.setdefault(keyword, area)
+        
+        if ahocorasick is not None:
+            self._keyword_automaton = ahocorasick.Automaton()
+            for keyword, area in keyword_areas.items():
+                self._keyword_automaton.add_word(keyword, (len(keyword), area))
+            self._keyword_automaton.make_automaton()
+        else:
+            # One named group per area, so a match's lastgroup is its area
+            self._keyword_automaton = None
+            groups = {}
+            for keyword, area in keyword_areas.items():
+                groups.setdefault(area, []).append(re.escape(keyword))
+            self._keyword_re = re.compile(r'\b(?:' + '|'.join(
+                f"(?P<{area}>{'|'.join(sorted(keywords, key=len, reverse=True))})"
+                for area, keywords in groups.items()
+            ) + r')')
     
     def identify_legal_area(self, message: str) -> str:
         """Identify the legal area based on the user message"""
         message_lower = message.lower()
         
-        # Keywords for different legal areas
-        keywords_map = {
-            "labor_law": ["employment", "workplace", "wages", "discrimination", "firing", "hiring", "overtime"],
-            "consumer_protection": ["consumer", "fraud", "scam", "warranty", "refund", "purchase"],
-            "immigration": ["visa", "citizenship", "deportation", "immigration", "green card"],
-            "family_law": ["divorce", "custody", "marriage", "adoption", "child support", "alimony"],
-            "criminal_law": ["criminal", "arrest", "charges", "felony", "misdemeanor", "court"],
-            "civil_rights": ["discrimination", "civil rights", "harassment", "freedom"],
-            "intellectual_property": ["patent", "trademark", "copyright", "intellectual property"],
-            "business_law": ["business", "corporation", "contract", "llc", "partnership"]
-        }
+        # Keywords match at the start of a word, so inflections still count ("arrested",
+        # "contracts") but words that merely contain one don't ("visa" in "advisable")
+        if self._keyword_automaton is not None:
+            areas = (
+                area for end, (length, area) in self._keyword_automaton.iter(message_lower)
+                if _starts_word(message_lower, end - length + 1)
+            )
+        else:
+            areas = (match.lastgroup for match in self._keyword_re.finditer(message_lower))
         
-        for area, keywords in keywords_map.items():
-            if any(keyword in message_lower for keyword in keywords):
-                return area
-        
-        return "general"
+        # Highest-priority area wins; stop scanning as soon as the top one is seen
+        best_area, best_rank = "general", len(self._area_rank)
+        for area in areas:
+            rank = self._area_rank[area]
+            if rank < best_rank:
+                best_area, best_rank = area, rank
+                if rank == 0:
+                    break
+        return best_area
     
     def get_relevant_gov_links(self, legal_area: str) -> List[str]:
         """Get relevant government links for the legal area"""
@@ -86,44 +170,18 @@ class LegalChatService:
     
     def format_response_with_steps(self, response: str, gov_links: List[str]) -> Dict[str, Any]:
         """Format AI response into step-by-step format with checkboxes"""
-        # Split response into steps (look for numbered items or bullet points)
-        steps = []
-        
-        # Try to identify steps in the response
-        lines = response.split('\n')
-        current_step = ""
-        step_number = 1
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Check if this line starts a new step
-            if (re.match(r'^\d+\.', line) or 
-                re.match(r'^Step \d+', line, re.IGNORECASE) or
-                line.startswith('-') or 
-                line.startswith('•')):
-                
-                if current_step:
-                    steps.append({
-                        "step_number": step_number - 1,
-                        "content": current_step.strip(),
-                        "completed": False
-                    })
-                
-                current_step = re.sub(r'^\d+\.|\-|•|Step \d+:?', '', line, flags=re.IGNORECASE).strip()
-                step_number += 1
-            else:
-                current_step += " " + line
-        
-        # Add the last step
-        if current_step:
-            steps.append({
-                "step_number": step_number - 1,
-                "content": current_step.strip(),
-                "completed": False
-            })
+        # Split response into steps (look for numbered items or bullet points);
+        # text before the first marker is step 0, and the n-th marker starts step n.
+        # Markers with no text are dropped but keep their number, so numbering can skip.
+        contents = [
+            " ".join(line.strip() for line in part.splitlines() if line.strip())
+            for part in STEP_SPLIT_RE.split(response)
+        ]
+        steps = [
+            {"step_number": number, "content": content, "completed": False}
+            for number, content in enumerate(contents)
+            if content
+        ]
         
         # If no clear steps were found, create a single step
         if not steps:
@@ -140,8 +198,40 @@ class LegalChatService:
             "has_checkboxes": len(steps) > 1
         }
     
-    async def get_legal_advice(self, user_id: str, message: str, session_id: str = None) -> Dict[str, Any]:
-        """Get legal advice from AI with step-by-step formatting"""
+    def _build_prompt(self, message: str, legal_area: str) -> str:
+        """Build the per-request part of the Gemini prompt; the guidelines live in the system instruction"""
+        return f"""Focus on {legal_area} if relevant.
+            
+            User question: {message}"""
+    
+    def _response_cache_key(self, message: str, legal_area: str) -> str:
+        """Key for the response cache"""
+        return hashlib.sha256(f"{GEMINI_MODEL}|{legal_area}|{message.strip().lower()}".encode()).hexdigest()
+    
+    def _describe_gemini_error(self, e: Exception) -> str:
+        """Turn a Gemini exception into a user-facing message"""
+        error_message = str(e)
+        print(f"❌ Error in get_legal_advice: {error_message}")
+        print(f"❌ Error type: {type(e).__name__}")
+        
+        # Check for specific error types
+        if "API_KEY" in error_message.upper():
+            error_message = "Invalid or expired Gemini API key. Please check your API key configuration."
+        elif "QUOTA" in error_message.upper():
+            error_message = "API quota exceeded. Please try again later or upgrade your API plan."
+        elif "MODEL" in error_message.upper():
+            error_message = f"Model '{GEMINI_MODEL}' not available. Please check model name."
+        elif "NETWORK" in error_message.upper() or "CONNECTION" in error_message.upper():
+            error_message = "Network connection error. Please check your internet connection."
+        
+        return error_message
+    
+    def start_legal_advice(self, user_id: str, message: str, session_id: str = None) -> Dict[str, Any]:
+        """Check access and open the chat session.
+
+        The user's message is returned in the context rather than written, so it
+        can be stored together with the AI response.
+        """
         # Check if user has access to chat advice
         if not self.subscription_service.check_feature_access(user_id, "chat_advice"):
             return {
@@ -157,91 +247,129 @@ class LegalChatService:
         if not session_id:
             session_id = db.create_chat_session(user_id, f"Legal Advice - {datetime.now().strftime('%Y-%m-%d %H:%M')}")
         
-        # Add user message to session
-        db.add_message_to_session(session_id, {
+        user_message = {
             "role": "user",
             "content": message,
             "has_checkboxes": False,
-            "gov_links": []
-        })
+            "gov_links": [],
+            "timestamp": datetime.now().isoformat()
+        }
+        
+        # Check if API key is available
+        if not GEMINI_API_KEY:
+            print("❌ Error: GEMINI_API_KEY not configured")
+            db.add_message_to_session(session_id, user_message)
+            return {
+                "error": "Gemini API key not configured. Please set GEMINI_API_KEY environment variable.",
+                "session_id": session_id
+            }
+        
+        return {
+            "session_id": session_id,
+            "legal_area": legal_area,
+            "gov_links": gov_links,
+            "user_message": user_message
+        }
+    
+    def _finish_legal_advice(self, advice: Dict[str, Any], ai_response: str) -> Dict[str, Any]:
+        """Format the AI response into steps and record the exchange in the session"""
+        formatted_response = self.format_response_with_steps(ai_response, advice["gov_links"])
+        
+        # Add user message and AI response to session in one write
+        db.add_messages_to_session(advice["session_id"], [advice["user_message"], {
+            "role": "assistant",
+            "content": ai_response,
+            "has_checkboxes": formatted_response["has_checkboxes"],
+            "gov_links": advice["gov_links"]
+        }])
+        
+        return formatted_response
+    
+    async def _generate_response(self, cache_key: str, message: str, legal_area: str) -> str:
+        """Ask Gemini for advice and cache the answer"""
+        print(f"🤖 Attempting to get AI response for legal area: {legal_area}")
+        print(f"🔍 Using Gemini model: {GEMINI_MODEL}")
+        
+        # Use Gemini model without blocking the event loop
+        print("📡 Sending request to Gemini API...")
+        response = await _MODEL.generate_content_async(self._build_prompt(message, legal_area))
+        print("✅ Received response from Gemini API")
+        self._response_cache[cache_key] = response.text
+        return response.text
+    
+    async def get_legal_advice(self, user_id: str, message: str, session_id: str = None) -> Dict[str, Any]:
+        """Get legal advice from AI with step-by-step formatting"""
+        advice = self.start_legal_advice(user_id, message, session_id)
+        if "error" in advice:
+            return advice
         
         try:
-            # Check if API key is available
-            if not GEMINI_API_KEY:
-                print("❌ Error: GEMINI_API_KEY not configured")
-                return {
-                    "error": "Gemini API key not configured. Please set GEMINI_API_KEY environment variable.",
-                    "session_id": session_id
-                }
-            
-            print(f"🤖 Attempting to get AI response for legal area: {legal_area}")
+            cache_key = self._response_cache_key(message, advice["legal_area"])
+            ai_response = self._response_cache.get(cache_key)
             
-            # Get AI response using Gemini 2.0 Flash model
-            system_prompt = f"""You are a legal advice assistant. Provide step-by-step legal guidance in a clear, structured format. 
-            
-            Guidelines:
-            1. Break down advice into numbered steps when appropriate
-            2. Be specific and actionable
-            3. Include relevant legal considerations
-            4. Mention when professional legal consultation is recommended
-            5. Focus on {legal_area} if relevant
-            6. Do not provide definitive legal conclusions
-            7. Always recommend consulting with a qualified attorney for complex matters
-            
-            Format your response with clear, actionable steps when possible.
-            
-            User question: {message}"""
-            
-            print(f"🔍 Using Gemini model: {GEMINI_MODEL}")
-            
-            # Use Gemini model
-            model = genai.GenerativeModel(GEMINI_MODEL)
-            print("📡 Sending request to Gemini API...")
-            response = model.generate_content(system_prompt)
-            print("✅ Received response from Gemini API")
-            ai_response = response.text
-            
-            # Format response with steps
-            formatted_response = self.format_response_with_steps(ai_response, gov_links)
-            
-            # Add AI response to session
-            db.add_message_to_session(session_id, {
-                "role": "assistant",
-                "content": ai_response,
-                "has_checkboxes": formatted_response["has_checkboxes"],
-                "gov_links": gov_links
-            })
+            if ai_response is None:
+                in_flight = self._in_flight.get(cache_key)
+                if in_flight is None:
+                    in_flight = asyncio.ensure_future(self._generate_response(cache_key, message, advice["legal_area"]))
+                    self._in_flight[cache_key] = in_flight
+                    in_flight.add_done_callback(lambda _: self._in_flight.pop(cache_key, None))
+                # shield so one caller disconnecting doesn't cancel the call for the others
+                ai_response = await asyncio.shield(in_flight)
             
             return {
-                "session_id": session_id,
-                "legal_area": legal_area,
-                **formatted_response
+                "session_id": advice["session_id"],
+                "legal_area": advice["legal_area"],
+                **self._finish_legal_advice(advice, ai_response)
             }
             
         except Exception as e:
-            error_message = str(e)
-            print(f"❌ Error in get_legal_advice: {error_message}")
-            print(f"❌ Error type: {type(e).__name__}")
-            
-            # Check for specific error types
-            if "API_KEY" in error_message.upper():
-                error_message = "Invalid or expired Gemini API key. Please check your API key configuration."
-            elif "QUOTA" in error_message.upper():
-                error_message = "API quota exceeded. Please try again later or upgrade your API plan."
-            elif "MODEL" in error_message.upper():
-                error_message = f"Model '{GEMINI_MODEL}' not available. Please check model name."
-            elif "NETWORK" in error_message.upper() or "CONNECTION" in error_message.upper():
-                error_message = "Network connection error. Please check your internet connection."
-            
+            # Keep the user's message in the history even though there is no answer
+            db.add_message_to_session(advice["session_id"], advice["user_message"])
             return {
-                "error": f"Failed to get legal advice: {error_message}",
-                "session_id": session_id,
+                "error": f"Failed to get legal advice: {self._describe_gemini_error(e)}",
+                "session_id": advice["session_id"],
                 "debug_info": {
                     "original_error": str(e),
                     "error_type": type(e).__name__
                 }
             }
     
+    async def stream_legal_advice(self, advice: Dict[str, Any], message: str) -> AsyncIterator[str]:
+        """Stream the AI response text as Gemini generates it.
+
+        ``advice`` is the context returned by ``start_legal_advice``; the full
+        response is stored in the session once the stream completes.
+        """
+        cache_key = self._response_cache_key(message, advice["legal_area"])
+        ai_response = self._response_cache.get(cache_key)
+        recorded = False
+        try:
+            if ai_response is not None:
+                yield ai_response
+            else:
+                chunks = []
+                try:
+                    response = await _MODEL.generate_content_async(
+                        self._build_prompt(message, advice["legal_area"]),
+                        stream=True
+                    )
+                    async for chunk in response:
+                        chunks.append(chunk.text)
+                        yield chunk.text
+                except Exception as e:
+                    yield f"\n\nFailed to get legal advice: {self._describe_gemini_error(e)}"
+                    return
+                
+                ai_response = "".join(chunks)
+                self._response_cache[cache_key] = ai_response
+            
+            self._finish_legal_advice(advice, ai_response)
+            recorded = True
+        finally:
+            # Keep the user's message even if generation failed or the client went away
+            if not recorded:
+                db.add_message_to_session(advice["session_id"], advice["user_message"])
+    
     def get_chat_history(self, user_id: str) -> List[Dict[str, Any]]:
         """Get user's chat session history"""
         return db.get_user_chat_sessions(user_id)
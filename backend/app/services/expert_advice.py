@@ -1,13 +1,56 @@
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+from cachetools import TTLCache
 from app.database.json_db import db
-from app.services.subscription import SubscriptionService
+from app.services.subscription import get_subscription_service, invalidate_subscription_info
+
+# Lawyer records only change when the database is reseeded, so derived lists can be kept briefly
+SPECIALIZATIONS_TTL = 60
+
+# Most slots offered per lawyer
+MAX_SLOTS = 20
+
+def _parse_local_time(value: str) -> datetime:
+    """Parse an ISO appointment time as naive local time (older records may carry an offset)"""
+    parsed = datetime.fromisoformat(value)
+    return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
+
+@lru_cache(maxsize=1)
+def _slot_template(current_time: datetime) -> Tuple[Dict[str, Any], ...]:
+    """Build the shared slot grid for the given minute (read-only; reused across lawyers)"""
+    # Generate slots for the next 7 days
+    slots = []
+    today = current_time.date()
+    
+    for day in range(7):
+        date = today + timedelta(days=day)
+        
+        # Skip weekends (simple logic)
+        if date.weekday() >= 5:
+            continue
+        
+        # Generate slots from 9 AM to 5 PM, only future ones today
+        first_hour = current_time.hour + 1 if day == 0 else 9
+        day_prefix = date.isoformat()
+        for hour in range(max(9, first_hour), 17):
+            slots.append({
+                "datetime": f"{day_prefix}T{hour:02d}:00:00",
+                "available": True,  # In real system, check against bookings
+                "duration_minutes": 60
+            })
+            if len(slots) >= MAX_SLOTS:
+                return tuple(slots)
+    
+    return tuple(slots)
 
 class ExpertAdviceService:
     """Service for handling lawyer consultations and booking system"""
     
     def __init__(self):
-        self.subscription_service = SubscriptionService(db)
+        self.subscription_service = get_subscription_service()
+        self._specializations_cache = TTLCache(maxsize=1, ttl=SPECIALIZATIONS_TTL)
+        self._lawyer_index_cache = TTLCache(maxsize=1, ttl=SPECIALIZATIONS_TTL)
     
     def get_available_lawyers(self, user_id: str, specialization: Optional[str] = None) -> Dict[str, Any]:
         """Get available lawyers based on user's subscription"""
@@ -21,19 +64,17 @@ class ExpertAdviceService:
                 "upgrade_required": True
             }
         
-        # Get all lawyers
-        all_lawyers = db.get_all_lawyers()
-        
-        # Filter by specialization if provided
+        # Get all lawyers, filtered by specialization if provided
         if specialization:
-            all_lawyers = [
-                lawyer for lawyer in all_lawyers 
-                if specialization.lower() in lawyer.get("specialization", "").lower()
-            ]
+            all_lawyers = self._lawyers_matching(specialization)
+        else:
+            all_lawyers = db.get_all_lawyers()
         
-        # Add availability information
-        for lawyer in all_lawyers:
-            lawyer["available_slots"] = self._generate_available_slots(lawyer["id"])
+        # Add availability information (copies, so indexed records stay untouched)
+        all_lawyers = [
+            {**lawyer, "available_slots": self._generate_available_slots(lawyer["id"])}
+            for lawyer in all_lawyers
+        ]
         
         return {
             "lawyers": all_lawyers,
@@ -63,38 +104,11 @@ class ExpertAdviceService:
             "usage_info": advice_limit
         }
     
-    def _generate_available_slots(self, lawyer_id: str) -> List[Dict[str, Any]]:
+    def _generate_available_slots(self, lawyer_id: str) -> Tuple[Dict[str, Any], ...]:
         """Generate available time slots for a lawyer (mock implementation)"""
-        # In a real system, this would integrate with the lawyer's actual calendar
-        
-        # Get existing bookings for this lawyer
-        all_bookings = []
-        # This would need to be implemented in the database
-        
-        # Generate slots for the next 7 days
-        slots = []
-        current_time = datetime.now()
-        
-        for day in range(7):
-            date = current_time + timedelta(days=day)
-            
-            # Skip weekends (simple logic)
-            if date.weekday() >= 5:
-                continue
-            
-            # Generate slots from 9 AM to 5 PM
-            for hour in range(9, 17):
-                slot_time = date.replace(hour=hour, minute=0, second=0, microsecond=0)
-                
-                # Only future slots
-                if slot_time > current_time:
-                    slots.append({
-                        "datetime": slot_time.isoformat(),
-                        "available": True,  # In real system, check against bookings
-                        "duration_minutes": 60
-                    })
-        
-        return slots[:20]  # Limit to 20 slots
+        # In a real system, this would integrate with the lawyer's actual calendar.
+        # Until then every lawyer shares the same grid, built at most once a minute.
+        return _slot_template(datetime.now().replace(second=0, microsecond=0))
     
     def book_consultation(
         self, 
@@ -121,7 +135,7 @@ class ExpertAdviceService:
         
         # Validate appointment time
         try:
-            appointment_dt = datetime.fromisoformat(appointment_time)
+            appointment_dt = _parse_local_time(appointment_time)
             if appointment_dt <= datetime.now():
                 return {"error": "Appointment time must be in the future"}
         except ValueError:
@@ -138,6 +152,9 @@ class ExpertAdviceService:
         }
         
         booking_id = db.create_booking(booking_data)
+        if booking_id is None:
+            return {"error": "Lawyer is already booked at that time"}
+        invalidate_subscription_info(user_id)
         
         return {
             "booking_id": booking_id,
@@ -146,16 +163,30 @@ class ExpertAdviceService:
             "appointment_time": appointment_time,
             "status": "pending",
             "description": description,
-            "usage_info": self.subscription_service.check_expert_advice_limit(user_id)
+            "usage_info": self._usage_after_booking(advice_limit)
+        }
+    
+    def _usage_after_booking(self, advice_limit: Dict[str, Any]) -> Dict[str, Any]:
+        """Account for a new booking in a previously fetched usage snapshot"""
+        if advice_limit.get("remaining") == "unlimited":
+            return advice_limit
+        
+        remaining = max(0, advice_limit["remaining"] - 1)
+        return {
+            **advice_limit,
+            "allowed": remaining > 0,
+            "remaining": remaining,
+            "used": advice_limit["used"] + 1
         }
     
     def get_user_bookings(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all bookings for a user"""
         bookings = db.get_user_bookings(user_id)
+        lawyers_by_id = {lawyer["id"]: lawyer for lawyer in db.get_all_lawyers()}
         
         # Add lawyer information to each booking
         for booking in bookings:
-            lawyer = db.get_lawyer(booking.get("lawyer_id"))
+            lawyer = lawyers_by_id.get(booking.get("lawyer_id"))
             if lawyer:
                 booking["lawyer_name"] = lawyer["name"]
                 booking["lawyer_specialization"] = lawyer["specialization"]
@@ -165,14 +196,13 @@ class ExpertAdviceService:
     def cancel_booking(self, booking_id: str, user_id: str) -> Dict[str, Any]:
         """Cancel a booking"""
         # Get booking to verify ownership
-        bookings = db.get_user_bookings(user_id)
-        booking = next((b for b in bookings if b["id"] == booking_id), None)
+        booking = db.get_booking(booking_id, user_id)
         
         if not booking:
             return {"error": "Booking not found or access denied"}
         
         # Check if booking can be cancelled (e.g., not too close to appointment time)
-        appointment_time = datetime.fromisoformat(booking["appointment_time"])
+        appointment_time = _parse_local_time(booking["appointment_time"])
         if appointment_time <= datetime.now() + timedelta(hours=2):
             return {"error": "Cannot cancel booking less than 2 hours before appointment"}
         
@@ -186,8 +216,7 @@ class ExpertAdviceService:
     
     def get_booking_details(self, booking_id: str, user_id: str) -> Dict[str, Any]:
         """Get detailed information about a booking"""
-        bookings = db.get_user_bookings(user_id)
-        booking = next((b for b in bookings if b["id"] == booking_id), None)
+        booking = db.get_booking(booking_id, user_id)
         
         if not booking:
             return {"error": "Booking not found or access denied"}
@@ -203,11 +232,35 @@ class ExpertAdviceService:
         
         return booking
     
+    def _lawyers_by_specialization(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Index lawyers by lowercased specialization"""
+        index = self._lawyer_index_cache.get("all")
+        if index is None:
+            index = {}
+            for lawyer in db.get_all_lawyers():
+                index.setdefault(lawyer.get("specialization", "").lower(), []).append(lawyer)
+            self._lawyer_index_cache["all"] = index
+        return index
+    
+    def _lawyers_matching(self, specialization: str) -> List[Dict[str, Any]]:
+        """Get lawyers whose specialization contains the given text (case-insensitive)"""
+        specialization = specialization.lower()
+        return [
+            lawyer
+            for spec, lawyers in self._lawyers_by_specialization().items()
+            if specialization in spec
+            for lawyer in lawyers
+        ]
+    
     def get_lawyer_specializations(self) -> List[str]:
         """Get list of all lawyer specializations"""
-        lawyers = db.get_all_lawyers()
-        specializations = list(set(lawyer.get("specialization", "") for lawyer in lawyers))
-        return [spec for spec in specializations if spec]  # Remove empty strings
+        specializations = self._specializations_cache.get("all")
+        if specializations is None:
+            lawyers = db.get_all_lawyers()
+            specializations = list(set(lawyer.get("specialization", "") for lawyer in lawyers))
+            specializations = [spec for spec in specializations if spec]  # Remove empty strings
+            self._specializations_cache["all"] = specializations
+        return specializations
     
     def reschedule_booking(
         self, 
@@ -217,27 +270,27 @@ class ExpertAdviceService:
     ) -> Dict[str, Any]:
         """Reschedule an existing booking"""
         # Get booking to verify ownership
-        bookings = db.get_user_bookings(user_id)
-        booking = next((b for b in bookings if b["id"] == booking_id), None)
+        booking = db.get_booking(booking_id, user_id)
         
         if not booking:
             return {"error": "Booking not found or access denied"}
         
         # Validate new appointment time
         try:
-            new_appointment_dt = datetime.fromisoformat(new_appointment_time)
+            new_appointment_dt = _parse_local_time(new_appointment_time)
             if new_appointment_dt <= datetime.now():
                 return {"error": "New appointment time must be in the future"}
         except ValueError:
             return {"error": "Invalid appointment time format"}
         
         # Check if original booking can be rescheduled
-        original_time = datetime.fromisoformat(booking["appointment_time"])
+        original_time = _parse_local_time(booking["appointment_time"])
         if original_time <= datetime.now() + timedelta(hours=4):
             return {"error": "Cannot reschedule booking less than 4 hours before appointment"}
         
-        # Update booking (this would need to be implemented in the database)
-        # For now, we'll return success
+        if not db.reschedule_booking(booking_id, booking["appointment_time"], new_appointment_time):
+            return {"error": "Requested time is no longer available"}
+        
         return {
             "success": True,
             "message": "Booking rescheduled successfully",
@@ -284,9 +337,14 @@ Disclaimer: This is preliminary guidance only. For specific legal advice tailore
     
     def _get_recommended_lawyers(self, legal_area: str) -> List[Dict[str, Any]]:
         """Get recommended lawyers for a specific legal area"""
-        all_lawyers = db.get_all_lawyers()
         # Filter lawyers by specialization matching the legal area
-        recommended = [
+        matches = self._lawyers_matching(legal_area)
+        
+        # If no specific match, return top-rated general lawyers
+        if not matches:
+            matches = db.get_all_lawyers()[:3]  # Top 3 lawyers
+        
+        return [
             {
                 "id": lawyer["id"],
                 "name": lawyer["name"],
@@ -294,21 +352,5 @@ Disclaimer: This is preliminary guidance only. For specific legal advice tailore
                 "rating": lawyer.get("rating", 4.5),
                 "is_online": lawyer.get("is_online", False)
             }
-            for lawyer in all_lawyers 
-            if legal_area.lower() in lawyer.get("specialization", "").lower()
-        ]
-        
-        # If no specific match, return top-rated general lawyers
-        if not recommended:
-            recommended = [
-                {
-                    "id": lawyer["id"],
-                    "name": lawyer["name"],
-                    "specialization": lawyer["specialization"],
-                    "rating": lawyer.get("rating", 4.5),
-                    "is_online": lawyer.get("is_online", False)
-                }
-                for lawyer in all_lawyers[:3]  # Top 3 lawyers
-            ]
-        
-        return recommended[:5]  # Return max 5 recommendations
\ No newline at end of file
+            for lawyer in matches[:5]  # Return max 5 recommendations
+        ]
\ No newline at end of file
@@ -3,26 +3,31 @@ import asyncio
 import uuid
 import os
 import time
-import re
-from typing import List, Dict, Any, Optional
+import hashlib
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Dict, Any, Optional, Set
 from pathlib import Path
 import sys
+from functools import lru_cache
+from itertools import islice
+from cachetools import LRUCache, TTLCache
 
 # Add the Final folder to the path to reuse existing RAG components
 sys.path.append(str(Path(__file__).parent.parent.parent.parent / "Final"))
 
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
-from langchain_pinecone import PineconeVectorStore
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
-from pinecone import Pinecone, ServerlessSpec
 from dotenv import load_dotenv
 
+# Loaders, model clients and Pinecone pull in torch, transformers and grpc, so they are
+# imported where first used; app startup doesn't pay for them unless /rag is hit.
+if TYPE_CHECKING:
+    from langchain.chains import RetrievalQA
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from pinecone import Pinecone
+
 from app.database.json_db import db
-from app.services.subscription import SubscriptionService
+from app.services.subscription import get_subscription_service
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -30,11 +35,137 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
+# Vectors per Pinecone upsert (Pinecone recommends 100) and upserts in flight at once.
+# A 384-dim vector plus its <=2000-char text is ~5 KB, so 100 per request stays well under
+# the 2 MB request limit and 10 concurrent requests well under the 50 MB/s namespace limit.
+PINECONE_BATCH_SIZE = int(os.getenv("PINECONE_BATCH_SIZE", "100"))
+PINECONE_UPSERT_CONCURRENCY = int(os.getenv("PINECONE_CONCURRENCY", "10"))
+
+# Embedded batches waiting for upload; bounds memory when embedding outpaces the network
+EMBED_QUEUE_SIZE = 4
+
+# Shared Pinecone index and the waits (seconds) between readiness checks after creating it
+PINECONE_INDEX_NAME = "legalai-index"
+PINECONE_READY_BACKOFF = (0.5, 1, 2, 4, 8)
+
+# Chunks per embedding forward pass (sentence-transformers length-sorts within each encode call)
+EMBEDDING_BATCH_SIZE = 64
+
+# Bytes of chunk text stored in Pinecone metadata; Pinecone caps metadata at 40 KB per
+# vector, and the rest is headroom for the loader's source/page fields
+METADATA_TEXT_BYTES = 39_000
+
+# Semantic chunk size bounds (characters); chunks at or below the minimum are dropped
+MAX_CHUNK_CHARS = 2000
+MIN_CHUNK_CHARS = 100
+
+# Per-user document set listings, kept briefly for UI polling and dropped on upload/delete
+DOCUMENT_SETS_CACHE = TTLCache(maxsize=10_000, ttl=10)
+
+# Ready-to-invoke QA chains keyed by (namespace, k); built without any Pinecone round trip
+QA_CHAIN_CACHE = LRUCache(maxsize=256)
+
+# Legal-specific prompt template shared by every QA chain
+LEGAL_QA_PROMPT = PromptTemplate(
+    template="""You are a legal AI assistant that answers questions based on the provided legal documents. 
+Use only the information from the context to answer the question. Be precise and cite relevant sections when possible.
+If the answer is not available in the provided documents, say "I cannot find this information in the provided documents."
+
+Legal Context:
+{context}
+
+Question: {question}
+
+Legal Analysis: """,
+    input_variables=["context", "question"]
+)
+
+def _metadata_text(text: str) -> str:
+    """Trim chunk text to fit Pinecone's metadata size limit"""
+    # UTF-8 is at most 4 bytes per character, so typical (<=2000 char) chunks skip the encode
+    if len(text) * 4 <= METADATA_TEXT_BYTES:
+        return text
+    return text.encode("utf-8")[:METADATA_TEXT_BYTES].decode("utf-8", errors="ignore")
+
+def _trailing_sentence(text: str) -> str:
+    """Return the text after the last sentence terminator (used as chunk overlap)"""
+    last_end = max(text.rfind('.'), text.rfind('!'), text.rfind('?'))
+    return text[last_end + 1:].strip() if last_end != -1 else ""
+
+def _unique_chunks(chunks: Iterable[Document]) -> Iterator[Document]:
+    """Drop chunks whose text already appeared (repeated headers, footers, boilerplate clauses)"""
+    seen: Set[bytes] = set()
+    duplicates = 0
+    for chunk in chunks:
+        digest = hashlib.blake2b(chunk.page_content.encode("utf-8"), digest_size=16).digest()
+        if digest in seen:
+            duplicates += 1
+            continue
+        seen.add(digest)
+        yield chunk
+    if duplicates:
+        logger.info(f"Skipped {duplicates} duplicate chunks")
+
+# Heavy clients are built once per process and shared by every RAGService instance.
+# Failed constructions raise, and lru_cache doesn't cache exceptions, so they are retried.
+@lru_cache(maxsize=1)
+def _get_embeddings() -> "HuggingFaceEmbeddings":
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name="sentence-transformers/all-MiniLM-L6-v2",
+        encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE}
+    )
+
+@lru_cache(maxsize=1)
+def _get_llm(api_key: Optional[str]) -> "ChatGoogleGenerativeAI":
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model="gemini-1.5-pro-latest", 
+        google_api_key=api_key, 
+        temperature=0.1
+    )
+
+@lru_cache(maxsize=1)
+def _get_pinecone(api_key: str) -> "Pinecone":
+    from pinecone import Pinecone
+    return Pinecone(api_key=api_key)
+
+def ensure_pinecone_index():
+    """Create the Pinecone index if it is missing and wait for it to become ready.
+
+    Blocking; run once at startup in a worker thread, never on the request path.
+    """
+    api_key = os.getenv("PINECONE_API_KEY")
+    if not api_key:
+        return
+    try:
+        pc = _get_pinecone(api_key)
+        if PINECONE_INDEX_NAME not in pc.list_indexes().names():
+            from pinecone import ServerlessSpec
+            logger.info(f"Creating new Pinecone index: {PINECONE_INDEX_NAME}")
+            pc.create_index(
+                name=PINECONE_INDEX_NAME,
+                dimension=384,  # For all-MiniLM-L6-v2
+                metric="cosine",
+                spec=ServerlessSpec(cloud="aws", region="us-east-1")
+            )
+            # Poll with backoff instead of a fixed wait; serverless indexes are often ready in seconds
+            for delay in PINECONE_READY_BACKOFF:
+                if pc.describe_index(PINECONE_INDEX_NAME).status["ready"]:
+                    break
+                time.sleep(delay)
+            else:
+                logger.warning(f"Pinecone index '{PINECONE_INDEX_NAME}' is not ready yet; continuing")
+        else:
+            logger.info(f"Pinecone index '{PINECONE_INDEX_NAME}' already exists")
+    except Exception as e:
+        logger.error(f"Error setting up Pinecone index: {e}")
+
 class RAGService:
     """Enhanced RAG service for legal document processing and retrieval"""
     
     def __init__(self):
-        self.subscription_service = SubscriptionService(db)
+        self.subscription_service = get_subscription_service()
         
         # RAG Configuration
         self.gemini_api_key = os.getenv("GEMINI_API_KEY")
@@ -42,52 +173,49 @@ class RAGService:
         
         # Initialize components with error handling
         try:
-            self.embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+            self.embeddings = _get_embeddings()
             logger.info("✅ Embeddings model loaded successfully")
         except Exception as e:
             logger.warning(f"⚠️ Failed to load embeddings model: {e}")
             self.embeddings = None
             
         try:
-            self.llm = ChatGoogleGenerativeAI(
-                model="gemini-1.5-pro-latest", 
-                google_api_key=self.gemini_api_key, 
-                temperature=0.1
-            )
+            self.llm = _get_llm(self.gemini_api_key)
             logger.info("✅ Gemini LLM initialized successfully")
         except Exception as e:
             logger.warning(f"⚠️ Failed to initialize Gemini LLM: {e}")
             self.llm = None
         
-        # Initialize Pinecone
+        # Initialize Pinecone; the index itself is created at startup and connected on first use
+        self.index_name = PINECONE_INDEX_NAME
+        self._index = None
+        self.pc = None
         if self.pinecone_api_key:
-            self.pc = Pinecone(api_key=self.pinecone_api_key)
-            self.index_name = "legalai-index"
-            self._ensure_pinecone_index()
+            try:
+                self.pc = _get_pinecone(self.pinecone_api_key)
+            except Exception as e:
+                logger.warning(f"⚠️ Failed to initialize Pinecone client: {e}")
         else:
             logger.warning("Pinecone API key not found. RAG functionality will be limited.")
-            self.pc = None
     
-    def _ensure_pinecone_index(self):
-        """Ensure Pinecone index exists"""
-        try:
-            if self.index_name not in self.pc.list_indexes().names():
-                logger.info(f"Creating new Pinecone index: {self.index_name}")
-                self.pc.create_index(
-                    name=self.index_name,
-                    dimension=384,  # For all-MiniLM-L6-v2
-                    metric="cosine",
-                    spec=ServerlessSpec(cloud="aws", region="us-east-1")
-                )
-                time.sleep(10)
-            else:
-                logger.info(f"Pinecone index '{self.index_name}' already exists")
-        except Exception as e:
-            logger.error(f"Error setting up Pinecone index: {e}")
+    def _get_index(self):
+        """Get the Pinecone index handle, connecting on first use; None if unavailable"""
+        if self._index is None and self.pc is not None:
+            try:
+                # Pinecone resolves the index host with a describe call, which fails if the
+                # index is missing, still provisioning or unreachable; retried on the next request
+                self._index = self.pc.Index(self.index_name)
+            except Exception as e:
+                logger.warning(f"⚠️ Pinecone index '{self.index_name}' unavailable: {e}")
+        return self._index
     
-    def semantic_chunk_documents(self, docs: List[Document]) -> List[Document]:
-        """Apply semantic chunking based on paragraph breaks and topic boundaries"""
-        semantic_chunks = []
+    def semantic_chunk_documents(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """Apply semantic chunking based on paragraph breaks and topic boundaries.
+
+        Chunks are yielded as soon as they are finalized, so pages can be
+        streamed in without holding the whole document in memory.
+        """
+        chunk_count = 0
         
         for doc in docs:
             text = doc.page_content
@@ -95,43 +223,51 @@ class RAGService:
             # Split by double newlines (paragraph breaks) first
             paragraphs = text.split('\n\n')
             
-            current_chunk = ""
+            current_parts: List[str] = []
+            current_len = 0  # length of " ".join(current_parts)
             for para in paragraphs:
                 para = para.strip()
                 if not para:
                     continue
                     
-                # If adding this paragraph would exceed 2000 chars, save current chunk
-                if len(current_chunk) + len(para) > 2000 and current_chunk:
-                    # Add overlap by including last sentence from previous chunk
-                    sentences = re.split(r'[.!?]+', current_chunk)
-                    overlap = sentences[-1].strip() if len(sentences) > 1 else ""
+                # If adding this paragraph would exceed the chunk size, save current chunk
+                if current_len + len(para) > MAX_CHUNK_CHARS and current_parts:
+                    current_chunk = " ".join(current_parts)
+                    
+                    # Add overlap by including the text after the last sentence end
+                    overlap = _trailing_sentence(current_chunk)
                     
-                    semantic_chunks.append(Document(
-                        page_content=current_chunk.strip(),
-                        metadata=doc.metadata
-                    ))
+                    # Skip very small chunks (parts are already stripped, so current_len is exact)
+                    if current_len > MIN_CHUNK_CHARS:
+                        chunk_count += 1
+                        yield Document(page_content=current_chunk, metadata=doc.metadata)
                     
                     # Start new chunk with overlap
-                    current_chunk = overlap + " " + para if overlap else para
+                    current_parts = [overlap, para] if overlap else [para]
+                    current_len = len(overlap) + 1 + len(para) if overlap else len(para)
                 else:
-                    current_chunk += " " + para if current_chunk else para
+                    current_len += len(para) + 1 if current_parts else len(para)
+                    current_parts.append(para)
             
-            # Add the last chunk
-            if current_chunk.strip():
-                semantic_chunks.append(Document(
-                    page_content=current_chunk.strip(),
-                    metadata=doc.metadata
-                ))
-        
-        # Filter out very small chunks
-        semantic_chunks = [chunk for chunk in semantic_chunks if len(chunk.page_content) > 100]
+            # Add the last chunk (skipping very small ones)
+            if current_len > MIN_CHUNK_CHARS:
+                chunk_count += 1
+                yield Document(page_content=" ".join(current_parts), metadata=doc.metadata)
         
-        logger.info(f"Generated {len(semantic_chunks)} semantic chunks")
-        return semantic_chunks
+        logger.info(f"Generated {chunk_count} semantic chunks")
     
-    def load_documents(self, file_path: str) -> List[Document]:
-        """Load documents from file path"""
+    def iter_documents(self, file_paths: List[str]) -> Iterator[Document]:
+        """Lazily load pages from each file in turn"""
+        for file_path in file_paths:
+            page_count = 0
+            for page in self.load_documents(file_path):
+                page_count += 1
+                yield page
+            logger.info(f"Loaded {page_count} pages from {file_path}")
+    
+    def load_documents(self, file_path: str) -> Iterator[Document]:
+        """Lazily load documents from file path, one page at a time"""
+        from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
         ext = os.path.splitext(file_path)[1].lower()
         if ext == ".pdf":
             loader = PyPDFLoader(file_path)
@@ -139,15 +275,69 @@ class RAGService:
             loader = Docx2txtLoader(file_path)
         else:
             raise ValueError(f"Unsupported file format: {ext}")
-        return loader.load()
+        return loader.lazy_load()
+    
+    async def _embed_and_upsert(
+        self,
+        chunks: Iterator[Document],
+        namespace: str,
+        batch_size: int,
+        upsert_concurrency: int
+    ) -> int:
+        """Embed chunks batch by batch in a worker thread while earlier batches upload to Pinecone.
+
+        ``chunks`` is consumed lazily (loading and chunking run in the worker
+        thread too); returns the number of chunks stored.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=EMBED_QUEUE_SIZE)
+        stored = 0
+        
+        async def produce():
+            nonlocal stored
+            while batch := await asyncio.to_thread(lambda: list(islice(chunks, batch_size))):
+                start = stored
+                stored += len(batch)
+                embeddings = await asyncio.to_thread(
+                    self.embeddings.embed_documents, [chunk.page_content for chunk in batch]
+                )
+                # Same layout PineconeVectorStore reads back at query time (text under "text")
+                await queue.put([
+                    (f"{namespace}-{start + j}", values, {**chunk.metadata, "text": _metadata_text(chunk.page_content)})
+                    for j, (chunk, values) in enumerate(zip(batch, embeddings))
+                ])
+            # Only signal completion on success; on failure the consumers are cancelled instead
+            for _ in range(upsert_concurrency):
+                await queue.put(None)
+        
+        async def consume():
+            while (vectors := await queue.get()) is not None:
+                await asyncio.to_thread(self._index.upsert, vectors=vectors, namespace=namespace)
+        
+        tasks = [asyncio.create_task(produce())]
+        tasks += [asyncio.create_task(consume()) for _ in range(upsert_concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            # Wait for the cancellations to land so no task outlives the call
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        
+        return stored
     
     async def process_and_store_documents(
         self, 
         file_paths: List[str], 
         user_id: str,
-        batch_size: int = 64
+        batch_size: int = PINECONE_BATCH_SIZE,
+        upsert_concurrency: int = PINECONE_UPSERT_CONCURRENCY
     ) -> Dict[str, Any]:
-        """Process and store documents in RAG system"""
+        """Process and store documents in RAG system.
+
+        Keep ``batch_size`` x vector size under Pinecone's 2 MB per-request limit, and
+        ``batch_size`` x vector size x ``upsert_concurrency`` per second under the 50 MB/s namespace limit.
+        """
         
         # Check if user has access to RAG functionality
         if not self.subscription_service.check_feature_access(user_id, "document_upload"):
@@ -161,6 +351,12 @@ class RAGService:
                 "success": False,
                 "error": "Pinecone not configured. Please add PINECONE_API_KEY to environment."
             }
+        
+        if not self._get_index():
+            return {
+                "success": False,
+                "error": "Pinecone index not available. Please try again shortly."
+            }
             
         if not self.embeddings:
             return {
@@ -169,50 +365,31 @@ class RAGService:
             }
         
         try:
-            # Load all documents
-            all_docs = []
-            for fp in file_paths:
-                docs = self.load_documents(fp)
-                all_docs.extend(docs)
-                logger.info(f"Loaded {len(docs)} pages from {fp}")
-            
-            # Create semantic chunks
-            chunks = self.semantic_chunk_documents(all_docs)
-            logger.info(f"Created {len(chunks)} chunks from all documents")
-            
             # Create unique namespace for this document set
             namespace = f"user_{user_id}_{uuid.uuid4().hex[:8]}"
             
-            # Store in Pinecone in batches
-            total_batches = (len(chunks) + batch_size - 1) // batch_size
-            for i in range(0, len(chunks), batch_size):
-                batch_chunks = chunks[i:i+batch_size]
-                batch_number = i // batch_size + 1
-                
-                PineconeVectorStore.from_documents(
-                    batch_chunks, 
-                    self.embeddings, 
-                    namespace=namespace, 
-                    index_name=self.index_name
-                )
-                logger.info(f"Stored batch {batch_number}/{total_batches}")
+            # Stream pages through the chunker into the embed/upload pipeline
+            chunks = _unique_chunks(self.semantic_chunk_documents(self.iter_documents(file_paths)))
+            chunk_count = await self._embed_and_upsert(chunks, namespace, batch_size, upsert_concurrency)
+            logger.info(f"Stored {chunk_count} chunks from all documents")
             
             # Store namespace info in database
             document_set = {
                 "id": namespace,
                 "user_id": user_id,
                 "file_paths": file_paths,
-                "chunk_count": len(chunks),
+                "chunk_count": chunk_count,
                 "created_at": time.time(),
                 "status": "ready"
             }
             db.store_document_set(document_set)
+            DOCUMENT_SETS_CACHE.pop(user_id, None)
             
             logger.info(f"✅ Successfully processed and stored documents for user {user_id}")
             return {
                 "success": True,
                 "namespace": namespace,
-                "chunks_created": len(chunks),
+                "chunks_created": chunk_count,
                 "message": "Documents successfully processed and indexed"
             }
             
@@ -223,6 +400,33 @@ class RAGService:
                 "error": f"Error processing documents: {str(e)}"
             }
     
+    def _get_qa_chain(self, namespace: str, k: int) -> "RetrievalQA":
+        """Get the cached QA chain for a namespace, building it on first use"""
+        key = (namespace, k)
+        qa_chain = QA_CHAIN_CACHE.get(key)
+        if qa_chain is None:
+            from langchain.chains import RetrievalQA
+            from langchain_pinecone import PineconeVectorStore
+            
+            # Wrap the already-open index handle; from_existing_index would reconnect on every query
+            vector_store = PineconeVectorStore(
+                index=self._index,
+                embedding=self.embeddings,
+                namespace=namespace
+            )
+            retriever = vector_store.as_retriever(
+                search_kwargs={"k": k, "namespace": namespace}
+            )
+            qa_chain = RetrievalQA.from_chain_type(
+                llm=self.llm,
+                chain_type="stuff",
+                retriever=retriever,
+                chain_type_kwargs={"prompt": LEGAL_QA_PROMPT},
+                return_source_documents=True
+            )
+            QA_CHAIN_CACHE[key] = qa_chain
+        return qa_chain
+    
     async def query_documents(
         self, 
         query: str, 
@@ -237,6 +441,12 @@ class RAGService:
                 "success": False,
                 "error": "Pinecone not configured"
             }
+        
+        if not self._get_index():
+            return {
+                "success": False,
+                "error": "Pinecone index not available"
+            }
             
         if not self.embeddings:
             return {
@@ -259,44 +469,11 @@ class RAGService:
                     "error": "Document set not found or access denied"
                 }
             
-            # Create vector store for querying
-            vector_store = PineconeVectorStore.from_existing_index(
-                index_name=self.index_name,
-                embedding=self.embeddings,
-                namespace=namespace
-            )
-            
-            retriever = vector_store.as_retriever(
-                search_kwargs={"k": k, "namespace": namespace}
-            )
-            
-            # Legal-specific prompt template
-            prompt_template = """You are a legal AI assistant that answers questions based on the provided legal documents. 
-Use only the information from the context to answer the question. Be precise and cite relevant sections when possible.
-If the answer is not available in the provided documents, say "I cannot find this information in the provided documents."
-
-Legal Context:
-{context}
-
-Question: {question}
-
-Legal Analysis: """
-
-            prompt = PromptTemplate(
-                template=prompt_template, 
-                input_variables=["context", "question"]
-            )
-            
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=retriever,
-                chain_type_kwargs={"prompt": prompt},
-                return_source_documents=True
-            )
+            qa_chain = self._get_qa_chain(namespace, k)
             
-            # Execute query
-            result = qa_chain.invoke({"query": query})
+            # Execute query without blocking the event loop (Gemini is called natively async,
+            # the Pinecone search runs in LangChain's executor)
+            result = await qa_chain.ainvoke({"query": query})
             
             # Format sources
             sources = []
@@ -322,7 +499,11 @@ Legal Analysis: """
     
     def get_user_document_sets(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all document sets for a user"""
-        return db.get_user_document_sets(user_id)
+        document_sets = DOCUMENT_SETS_CACHE.get(user_id)
+        if document_sets is None:
+            document_sets = db.get_user_document_sets(user_id)
+            DOCUMENT_SETS_CACHE[user_id] = document_sets
+        return document_sets
     
     def delete_document_set(self, namespace: str, user_id: str) -> Dict[str, Any]:
         """Delete a document set"""
@@ -337,6 +518,9 @@ Legal Analysis: """
             # Note: In production, you'd also want to delete from Pinecone
             # For now, we'll just mark as deleted in our database
             db.delete_document_set(namespace)
+            DOCUMENT_SETS_CACHE.pop(user_id, None)
+            for key in [key for key in QA_CHAIN_CACHE if key[0] == namespace]:
+                QA_CHAIN_CACHE.pop(key, None)
             
             return {
                 "success": True,
@@ -1,7 +1,21 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Dict, List
+from cachetools import TTLCache
+from app.database.json_db import db
 from app.models.schemas import SubscriptionTier
 
+# Stored tier names -> enum, so per-request checks skip Enum value lookup
+_TIER_BY_NAME = {tier.value: tier for tier in SubscriptionTier}
+
+# Per-user subscription info for /my-subscription, which the frontend polls on every page load
+SUBSCRIPTION_INFO_CACHE = TTLCache(maxsize=10_000, ttl=30)
+
+
+def invalidate_subscription_info(user_id: str):
+    """Drop a user's cached subscription info after their tier or usage changes"""
+    SUBSCRIPTION_INFO_CACHE.pop(user_id, None)
+
 class SubscriptionService:
     """Service to handle subscription-based feature access"""
     
@@ -11,25 +25,25 @@ class SubscriptionService:
             "case_study_weekly_limit": 5,
             "expert_advice_weekly_limit": 0,
             "chat_advice_limit": None,  # Unlimited
-            "features": ["chat_advice", "case_study_limited"]
+            "features": frozenset({"chat_advice", "case_study_limited"})
         },
         SubscriptionTier.STANDARD: {
             "case_study_weekly_limit": None,  # Unlimited
             "expert_advice_weekly_limit": 0,
             "chat_advice_limit": None,  # Unlimited
-            "features": ["chat_advice", "case_study_unlimited"]
+            "features": frozenset({"chat_advice", "case_study_unlimited"})
         },
         SubscriptionTier.PREMIUM: {
             "case_study_weekly_limit": None,  # Unlimited
             "expert_advice_weekly_limit": 3,
             "chat_advice_limit": None,  # Unlimited
-            "features": ["chat_advice", "case_study_unlimited", "expert_advice_limited"]
+            "features": frozenset({"chat_advice", "case_study_unlimited", "expert_advice_limited"})
         },
         SubscriptionTier.PLATINUM: {
             "case_study_weekly_limit": None,  # Unlimited
             "expert_advice_weekly_limit": None,  # Unlimited
             "chat_advice_limit": None,  # Unlimited
-            "features": ["chat_advice", "case_study_unlimited", "expert_advice_unlimited"]
+            "features": frozenset({"chat_advice", "case_study_unlimited", "expert_advice_unlimited"})
         }
     }
     
@@ -42,7 +56,7 @@ class SubscriptionService:
         if not user:
             return False
         
-        tier = SubscriptionTier(user.get("subscription_tier", "Basic"))
+        tier = _TIER_BY_NAME.get(user.get("subscription_tier"), SubscriptionTier.BASIC)
         tier_features = self.TIER_LIMITS[tier]["features"]
         
         return feature in tier_features
@@ -53,7 +67,7 @@ class SubscriptionService:
         if not user:
             return {"allowed": False, "reason": "User not found"}
         
-        tier = SubscriptionTier(user.get("subscription_tier", "Basic"))
+        tier = _TIER_BY_NAME.get(user.get("subscription_tier"), SubscriptionTier.BASIC)
         weekly_limit = self.TIER_LIMITS[tier]["case_study_weekly_limit"]
         
         # If unlimited access
@@ -61,15 +75,8 @@ class SubscriptionService:
             return {"allowed": True, "remaining": "unlimited"}
         
         # Count case studies in the last 7 days
-        case_studies = self.db.get_user_case_studies(user_id)
         week_ago = datetime.now() - timedelta(days=7)
-        
-        recent_studies = [
-            study for study in case_studies 
-            if datetime.fromisoformat(study["created_at"]) > week_ago
-        ]
-        
-        used_count = len(recent_studies)
+        used_count = self.db.count_user_case_studies_since(user_id, week_ago.isoformat())
         remaining = max(0, weekly_limit - used_count)
         
         return {
@@ -86,7 +93,7 @@ class SubscriptionService:
         if not user:
             return {"allowed": False, "reason": "User not found"}
         
-        tier = SubscriptionTier(user.get("subscription_tier", "Basic"))
+        tier = _TIER_BY_NAME.get(user.get("subscription_tier"), SubscriptionTier.BASIC)
         weekly_limit = self.TIER_LIMITS[tier]["expert_advice_weekly_limit"]
         
         # If no access
@@ -98,15 +105,8 @@ class SubscriptionService:
             return {"allowed": True, "remaining": "unlimited"}
         
         # Count bookings in the last 7 days
-        bookings = self.db.get_user_bookings(user_id)
         week_ago = datetime.now() - timedelta(days=7)
-        
-        recent_bookings = [
-            booking for booking in bookings 
-            if datetime.fromisoformat(booking["created_at"]) > week_ago
-        ]
-        
-        used_count = len(recent_bookings)
+        used_count = self.db.count_user_bookings_since(user_id, week_ago.isoformat())
         remaining = max(0, weekly_limit - used_count)
         
         return {
@@ -119,20 +119,24 @@ class SubscriptionService:
     
     def get_subscription_info(self, user_id: str) -> Dict[str, any]:
         """Get comprehensive subscription information for user"""
+        subscription_info = SUBSCRIPTION_INFO_CACHE.get(user_id)
+        if subscription_info is not None:
+            return subscription_info
+        
         user = self.db.get_user_by_id(user_id)
         if not user:
             return {"error": "User not found"}
         
-        tier = SubscriptionTier(user.get("subscription_tier", "Basic"))
+        tier = _TIER_BY_NAME.get(user.get("subscription_tier"), SubscriptionTier.BASIC)
         tier_info = self.TIER_LIMITS[tier]
         
         # Get usage information
         case_study_info = self.check_case_study_limit(user_id)
         expert_advice_info = self.check_expert_advice_limit(user_id)
         
-        return {
+        subscription_info = {
             "current_tier": tier.value,
-            "features": tier_info["features"],
+            "features": sorted(tier_info["features"]),
             "limits": {
                 "case_study": {
                     "weekly_limit": tier_info["case_study_weekly_limit"],
@@ -148,6 +152,8 @@ class SubscriptionService:
             },
             "subscription_expiry": user.get("subscription_expiry")
         }
+        SUBSCRIPTION_INFO_CACHE[user_id] = subscription_info
+        return subscription_info
     
     def upgrade_subscription(self, user_id: str, new_tier: SubscriptionTier, duration_months: int = 1) -> bool:
         """Upgrade user subscription"""
@@ -163,7 +169,9 @@ class SubscriptionService:
             "subscription_expiry": expiry
         }
         
-        return self.db.update_user(user_id, update_data)
+        updated = self.db.update_user(user_id, update_data)
+        invalidate_subscription_info(user_id)
+        return updated
     
     def check_subscription_expiry(self, user_id: str) -> Dict[str, any]:
         """Check if subscription has expired and downgrade if necessary"""
@@ -182,6 +190,13 @@ class SubscriptionService:
                 "subscription_tier": SubscriptionTier.BASIC.value,
                 "subscription_expiry": None
             })
+            invalidate_subscription_info(user_id)
             return {"expired": True, "downgraded_to": SubscriptionTier.BASIC.value}
         
-        return {"expired": False, "expires_at": expiry_date}
\ No newline at end of file
+        return {"expired": False, "expires_at": expiry_date}
+
+
+@lru_cache(maxsize=1)
+def get_subscription_service() -> SubscriptionService:
+    """Shared SubscriptionService (stateless apart from the db handle)"""
+    return SubscriptionService(db)
@@ -0,0 +1,37 @@
+import hashlib
+import os
+from typing import Any, Callable, Dict, Optional, Tuple
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+
+# Cache lifetimes (seconds) for slowly-changing lawyer data
+LAWYERS_CACHE_EXPIRE = 30
+SPECIALIZATIONS_CACHE_EXPIRE = 3600
+
+def init_cache():
+    """Initialize the response cache (Redis if REDIS_URL is set, in-memory otherwise)"""
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        from redis import asyncio as aioredis
+        from fastapi_cache.backends.redis import RedisBackend
+        FastAPICache.init(RedisBackend(aioredis.from_url(redis_url)), prefix="legalai-cache")
+    else:
+        FastAPICache.init(InMemoryBackend(), prefix="legalai-cache")
+
+def user_key_builder(
+    func: Callable,
+    namespace: str = "",
+    *,
+    request: Any = None,
+    response: Any = None,
+    args: Tuple = (),
+    kwargs: Optional[Dict[str, Any]] = None
+) -> str:
+    """Build a cache key from the user's id and tier plus the endpoint's own parameters"""
+    kwargs = dict(kwargs or {})
+    current_user = kwargs.pop("current_user", None) or {}
+    user_part = f"{current_user.get('id')}:{current_user.get('subscription_tier')}"
+    # Only plain request parameters go into the key, not injected dependencies such as services
+    plain = sorted((k, v) for k, v in kwargs.items() if v is None or isinstance(v, (str, int, float, bool)))
+    params = hashlib.md5(repr(plain).encode()).hexdigest()
+    return f"{FastAPICache.get_prefix()}:{namespace}:{func.__module__}:{func.__name__}:{user_part}:{params}"
@@ -0,0 +1,17 @@
+from typing import Any, Dict
+from fastapi import HTTPException, status
+
+def raise_for_error(result: Dict[str, Any], status_code: int = status.HTTP_400_BAD_REQUEST):
+    """Translate a service error dict into an HTTPException.
+
+    Results flagged with ``upgrade_required`` become 403s and ``file_too_large``
+    413s; any other error uses ``status_code``. Results without an ``error`` key
+    pass through untouched.
+    """
+    if "error" not in result:
+        return
+    if result.get("upgrade_required"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=result["error"])
+    if result.get("file_too_large"):
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=result["error"])
+    raise HTTPException(status_code=status_code, detail=result["error"])
@@ -1,7 +1,8 @@
 from fastapi import FastAPI, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 import uvicorn
+import asyncio
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -11,8 +12,10 @@ load_dotenv()
 
 # Import all route modules
 from app.routes import auth, chat, case_study, expert_advice, rag
-from app.services.subscription import SubscriptionService
+from app.services.subscription import SubscriptionService, get_subscription_service
+from app.services.rag import ensure_pinecone_index
 from app.database.json_db import db
+from app.utils.cache import init_cache
 
 # Create FastAPI app
 app = FastAPI(
@@ -20,7 +23,8 @@ app = FastAPI(
     description="A professional, subscription-based legal advice and recommendation web application with AI-powered chat, case study analysis, expert lawyer consultations, and visual mind maps of legal documents.",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware for frontend integration
@@ -30,6 +34,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Session-Id", "X-Legal-Area"],  # Sent with streamed chat advice
 )
 
 # Include all routers
@@ -119,9 +124,11 @@ from app.routes.auth import get_current_user
 from fastapi import Depends
 
 @app.get("/my-subscription", tags=["subscription"])
-async def get_my_subscription(current_user: dict = Depends(get_current_user)):
+async def get_my_subscription(
+    current_user: dict = Depends(get_current_user),
+    subscription_service: SubscriptionService = Depends(get_subscription_service)
+):
     """Get current user's subscription information"""
-    subscription_service = SubscriptionService(db)
     subscription_info = subscription_service.get_subscription_info(current_user["id"])
     return subscription_info
 
@@ -129,7 +136,7 @@ async def get_my_subscription(current_user: dict = Depends(get_current_user)):
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     """Custom HTTP exception handler"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "error": True,
@@ -141,7 +148,7 @@ async def http_exception_handler(request, exc):
 @app.exception_handler(Exception)
 async def general_exception_handler(request, exc):
     """General exception handler"""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "error": True,
@@ -166,6 +173,17 @@ async def startup_event():
     data_dir.mkdir(parents=True, exist_ok=True)
     
     print("✅ Directories initialized")
+    
+    # Response cache for read-heavy endpoints
+    init_cache()
+    print("✅ Cache initialized")
+    
+    # Start the write-behind flusher for chat messages
+    app.state.message_flusher = asyncio.create_task(db.run_message_flusher())
+    
+    # Create/await the Pinecone index once, in the background, so neither startup nor
+    # the first /rag request blocks on its readiness poll
+    app.state.pinecone_setup = asyncio.create_task(asyncio.to_thread(ensure_pinecone_index))
     print("✅ Database initialized")
     print("✅ Services ready")
     print("📡 API server is ready!")
@@ -175,6 +193,13 @@ async def startup_event():
 async def shutdown_event():
     """Cleanup on shutdown"""
     print("🛑 LegalAI WebApp API shutting down...")
+    
+    # Stop the message flusher; it writes any remaining buffered messages on exit
+    app.state.message_flusher.cancel()
+    try:
+        await app.state.message_flusher
+    except asyncio.CancelledError:
+        pass
     print("✅ Cleanup completed")
 
 # Main function to run the server
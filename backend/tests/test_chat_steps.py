@@ -0,0 +1,52 @@
+import pytest
+
+from app.services.chat import LegalChatService
+
+
+@pytest.fixture
+def service():
+    # format_response_with_steps doesn't touch instance state, so skip __init__
+    return LegalChatService.__new__(LegalChatService)
+
+
+def steps(service, response):
+    return [
+        (step["step_number"], step["content"])
+        for step in service.format_response_with_steps(response, [])["steps"]
+    ]
+
+
+def test_preamble_is_step_zero_and_continuation_lines_are_joined(service):
+    response = "Intro text\n1. File a claim\n2. Keep records\n   of all emails"
+    assert steps(service, response) == [
+        (0, "Intro text"),
+        (1, "File a claim"),
+        (2, "Keep records of all emails"),
+    ]
+
+
+def test_bullets_and_step_prefixes_are_markers(service):
+    assert steps(service, "- a\n• b\nStep 3 c\nSTEP 4: d") == [(1, "a"), (2, "b"), (3, "c"), (4, "d")]
+
+
+def test_step_prefix_allows_any_blank_run(service):
+    assert steps(service, "step  1: Call\nStep\t2: Write") == [(1, "Call"), (2, "Write")]
+
+
+def test_hyphens_inside_a_step_are_kept(service):
+    assert steps(service, "1. File a follow-up claim") == [(1, "File a follow-up claim")]
+
+
+def test_only_line_start_markers_split(service):
+    assert steps(service, "Step 1: see Step 3: later") == [(1, "see Step 3: later")]
+
+
+def test_empty_markers_keep_their_number(service):
+    assert steps(service, "1.\n2. Second") == [(2, "Second")]
+
+
+def test_response_without_markers_is_a_single_step(service):
+    result = service.format_response_with_steps("no markers here", ["https://example.gov"])
+    assert result["steps"] == [{"step_number": 0, "content": "no markers here", "completed": False}]
+    assert result["has_checkboxes"] is False
+    assert result["government_links"] == ["https://example.gov"]